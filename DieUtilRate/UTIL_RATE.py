@@ -1,16 +1,20 @@
 import os
-import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
-import matplotlib.pyplot as plt
+import matplotlib
 import numpy as np
 #import cv2
 import argparse
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.colors import LinearSegmentedColormap
-import math
+from matplotlib.figure import Figure
 import imageio
-import io
 
-from PIL import Image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from LgParser import load_lg, load_opt, load_post
 
 # Component class to hold information about each component
 class Component:
@@ -85,40 +89,12 @@ def read_lg_file(file_path: str, placement_rows: List[PlacementRow], components:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # Parse Alpha and Beta values
-        if line.startswith("Alpha"):
-            _, alpha_value = line.split()
-            alpha = int(alpha_value)
-        elif line.startswith("Beta"):
-            _, beta_value = line.split()
-            beta = int(beta_value)
-        # Parse DieSize
-        elif line.startswith("DieSize"):
-            die_size = list(map(int, re.findall(r"\d+", line)))
-        # Parse PlacementRows
-        elif line.startswith("PlacementRows"):
-            try:
-                _, x, y, site_width, site_height, num_sites = line.split()
-                placement_rows.append(PlacementRow(int(x), int(y), int(site_width), int(site_height), int(num_sites)))
-            except ValueError:
-                print(f"Skipping malformed PlacementRows line: {line}")
-        # Parse Component
-        else:
-            tokens = line.split()
-            if len(tokens) != 6:
-                print(f"Skipping malformed Component line: {line}")
-                continue
-            name, x, y, w, h, is_fixed_str = tokens
-            is_fixed = (is_fixed_str == "FIX")
-            components.append(Component(name, int(x), int(y), int(w), int(h), is_fixed))
+    placement = load_lg(file_path)
+    for x, y, site_width, site_height, num_sites in placement.rows.tolist():
+        placement_rows.append(PlacementRow(x, y, site_width, site_height, num_sites))
+    columns = (placement.x.tolist(), placement.y.tolist(), placement.w.tolist(), placement.h.tolist(), placement.fixed.tolist())
+    for name, x, y, w, h, is_fixed in zip(placement.names, *columns):
+        components.append(Component(name, x, y, w, h, is_fixed))
 
 # Function to read and parse the opt file
 def read_opt_file(file_path: str, banking_cells: List[BankingCell]) -> None:
@@ -132,25 +108,10 @@ def read_opt_file(file_path: str, banking_cells: List[BankingCell]) -> None:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-
-    for line in lines:
-        line = line.strip()
-        if not line or not line.startswith("Banking_Cell:"):
-            continue
-
-        # Parse Banking_Cell line
-        try:
-            line = line.replace("Banking_Cell:", "").strip()
-            ff_list_part, merged_part = line.split("-->")
-            ff_list = ff_list_part.split()
-            merged_tokens = merged_part.split()
-            merged_name = merged_tokens[0]
-            x, y, w, h = map(int, merged_tokens[1:])
-            banking_cells.append(BankingCell(ff_list, merged_name, x, y, w, h))
-        except ValueError:
-            print(f"Skipping malformed Banking_Cell line: {line}")
+    steps = load_opt(file_path)
+    columns = (steps.x.tolist(), steps.y.tolist(), steps.w.tolist(), steps.h.tolist())
+    for i, (merged_name, x, y, w, h) in enumerate(zip(steps.merge_names, *columns)):
+        banking_cells.append(BankingCell(steps.removed(i), merged_name, x, y, w, h))
 
 def read_post_file(file_path: str, banking_cells: List[BankingCell], merged_ff_updates: List[MergedFFUpdate]) -> None:
     """
@@ -164,30 +125,10 @@ def read_post_file(file_path: str, banking_cells: List[BankingCell], merged_ff_u
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    with open(file_path, "r") as file:
-        lines = file.readlines()
-
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx].strip()
-        if not line:
-            idx += 1
-            continue
-
-        # Parse merged ff coordinates
-        x, y = map(int, line.split())
-        idx += 1
-
-        # Parse number of moved cells
-        num_moved_cells = int(lines[idx].strip())
-        idx += 1
-
-        moved_cells = []
-        for _ in range(num_moved_cells):
-            cell_line = lines[idx].strip()
-            name, cell_x, cell_y = cell_line.split()
-            moved_cells.append(MovedCell(name, int(cell_x), int(cell_y)))
-            idx += 1
+    post = load_post(file_path)
+    for i, (x, y) in enumerate(zip(post.x.tolist(), post.y.tolist())):
+        names, cell_xs, cell_ys = post.moved(i)
+        moved_cells = [MovedCell(name, cell_x, cell_y) for name, cell_x, cell_y in zip(names, cell_xs.tolist(), cell_ys.tolist())]
 
         # Assign new FF from corresponding BankingCell
         if len(merged_ff_updates) < len(banking_cells):
@@ -197,6 +138,235 @@ def read_post_file(file_path: str, banking_cells: List[BankingCell], merged_ff_u
 
         merged_ff_updates.append(MergedFFUpdate(x, y, moved_cells, new_ff))
 
+def rasterize_utilization(grid: np.ndarray, xs, ys, ws, hs, origin, step, sign: float = 1.0) -> None:
+    """
+    Accumulate the fractional overlap of rectangles into a utilization grid.
+
+    The overlap of a rectangle with bin (j, i) is the product of its overlap
+    lengths along x and y, so per-axis weights are computed for every
+    rectangle and their outer products are summed into the grid with one
+    np.bincount per span size. Rectangles are clipped to the grid first, so
+    parts outside it are dropped.
+
+    Args:
+        grid (np.ndarray): (yStepNum, xStepNum) grid updated in place.
+        xs, ys, ws, hs: Lower-left corners and sizes of the rectangles.
+        origin (tuple): (min_x, min_y) of the grid.
+        step (tuple): (x_step, y_step) bin size.
+        sign (float): 1.0 to add the rectangles, -1.0 to remove them.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    if xs.size == 0:
+        return
+    ys = np.asarray(ys, dtype=np.float64)
+    ws = np.asarray(ws, dtype=np.float64)
+    hs = np.asarray(hs, dtype=np.float64)
+    y_num, x_num = grid.shape
+    min_x, min_y = origin
+    x_step, y_step = step
+
+    # clip to the grid, so no rectangle spans more bins than the grid has
+    x_lo = np.maximum(xs, min_x)
+    x_hi = np.minimum(xs + ws, min_x + x_num * x_step)
+    y_lo = np.maximum(ys, min_y)
+    y_hi = np.minimum(ys + hs, min_y + y_num * y_step)
+    keep = (x_hi > x_lo) & (y_hi > y_lo)
+    if not keep.all():
+        x_lo, x_hi, y_lo, y_hi = x_lo[keep], x_hi[keep], y_lo[keep], y_hi[keep]
+        if x_lo.size == 0:
+            return
+    xs, ws, ys, hs = x_lo, x_hi - x_lo, y_lo, y_hi - y_lo
+
+    first_x = np.floor((xs - min_x) / x_step).astype(np.int64)
+    span_x = np.maximum(np.ceil((xs + ws - min_x) / x_step).astype(np.int64) - first_x, 1)
+    first_y = np.floor((ys - min_y) / y_step).astype(np.int64)
+    span_y = np.maximum(np.ceil((ys + hs - min_y) / y_step).astype(np.int64) - first_y, 1)
+
+    def axis_weights(first, span, start, length, low, bin_size, bin_num):
+        idx = first[:, None] + np.arange(span)
+        overlap = (np.minimum(start[:, None] + length[:, None], low + (idx + 1) * bin_size)
+                   - np.maximum(start[:, None], low + idx * bin_size))
+        inside = (idx >= 0) & (idx < bin_num)
+        return np.clip(idx, 0, bin_num - 1), np.where(inside, np.maximum(overlap, 0.0), 0.0)
+
+    # rectangles are grouped by how many bins they span, so one huge macro
+    # does not widen the weight arrays of every small cell
+    span_key = span_y * (x_num + 1) + span_x
+    flat_grid = grid.reshape(-1)
+    for key in np.unique(span_key):
+        group = span_key == key
+        sx, sy = int(span_x[group][0]), int(span_y[group][0])
+        idx_x, weight_x = axis_weights(first_x[group], sx, xs[group], ws[group], min_x, x_step, x_num)
+        idx_y, weight_y = axis_weights(first_y[group], sy, ys[group], hs[group], min_y, y_step, y_num)
+        flat_idx = idx_y[:, :, None] * x_num + idx_x[:, None, :]
+        weights = weight_y[:, :, None] * weight_x[:, None, :]
+        flat_grid += sign * np.bincount(flat_idx.ravel(), weights.ravel(), minlength=flat_grid.size) / (x_step * y_step)
+
+def remove_component(components: List[Component], component_slot: dict, name: str) -> Component:
+    """
+    Remove a component by name in O(1) by moving the last component into its slot.
+
+    Args:
+        components (List[Component]): Component list, order is not kept.
+        component_slot (dict): name -> index in components, updated in place.
+        name (str): Name of the component to remove.
+
+    Returns:
+        Component: The removed component, None if the name is unknown.
+    """
+    slot = component_slot.pop(name, None)
+    if slot is None:
+        return None
+    removed = components[slot]
+    last = components.pop()
+    if slot < len(components):
+        components[slot] = last
+        component_slot[last.name] = slot
+    return removed
+
+def utilization_cmap() -> LinearSegmentedColormap:
+    # 灰階的深淺降低幅度
+    colors = [(1, 1, 1), (1, 1, 0), (1, 0, 0)]  # 白色 -> 黃色 -> 紅色
+    positions = [0.0, 0.5, 1.0]  # 對應位置
+    return LinearSegmentedColormap.from_list("custom_red_yellow_white", list(zip(positions, colors)))
+
+def replay_utilization(grid_utilization: np.ndarray, grid_origin, grid_step, components: List[Component],
+                       banking_cells: List[BankingCell], merged_ff_updates: List[MergedFFUpdate], stepCut: int):
+    """
+    Replay every optimization step on the utilization grid.
+
+    Args:
+        grid_utilization (np.ndarray): Grid holding the initial utilization, updated in place.
+        grid_origin (tuple): (min_x, min_y) of the grid.
+        grid_step (tuple): (x_step, y_step) bin size.
+        components (List[Component]): Components of the initial placement, updated in place.
+        banking_cells (List[BankingCell]): Optimization steps.
+        merged_ff_updates (List[MergedFFUpdate]): Legalized result of every step.
+        stepCut (int): Step interval for emitting snapshots.
+
+    Yields:
+        tuple: Heatmap snapshot (utilization copy, title, vmin, vmax) for render_heatmap.
+    """
+    vmin, vmax = grid_utilization.min(), grid_utilization.max()
+    yield grid_utilization.copy(), f"Grid Utilization Heatmap (Step {-1}, initial log layout)", vmin, vmax
+
+    component_slot = {compo.name: slot for slot, compo in enumerate(components)}
+    for k, cell in enumerate(banking_cells):
+        # rectangles leaving and entering the grid in this step, rasterized in one batch each
+        removed_rects = []
+        added_rects = []
+
+        # 刪除 banked cells
+        for delname in cell.ff_list:
+            compo = remove_component(components, component_slot, delname)
+            if compo is not None:
+                removed_rects.append((compo.x, compo.y, compo.w, compo.h))
+
+        # 加入 new ff
+        if k < len(merged_ff_updates):
+            component_slot[cell.merged_name] = len(components)
+            components.append(Component(cell.merged_name, merged_ff_updates[k].x, merged_ff_updates[k].y, cell.w, cell.h, False))
+            added_rects.append((merged_ff_updates[k].x, merged_ff_updates[k].y, cell.w, cell.h))
+
+        # 移動 ff
+        if k < len(merged_ff_updates):
+            for moved in merged_ff_updates[k].moved_cells:
+                slot = component_slot.get(moved.name)
+                if slot is None:
+                    continue
+                comp = components[slot]
+                removed_rects.append((comp.x, comp.y, comp.w, comp.h))
+                #移動
+                comp.x = moved.x
+                comp.y = moved.y
+                added_rects.append((comp.x, comp.y, comp.w, comp.h))
+
+        if removed_rects:
+            rasterize_utilization(grid_utilization, *zip(*removed_rects), grid_origin, grid_step, sign=-1.0)
+        if added_rects:
+            rasterize_utilization(grid_utilization, *zip(*added_rects), grid_origin, grid_step)
+
+        # Add intermediate heatmap snapshot
+        if (k % stepCut == 0 and k > 0) or k == len(banking_cells) - 1:
+            yield grid_utilization.copy(), f"Grid Utilization Heatmap (Step {k})", 0, 1
+
+def render_heatmap(snapshot, dpi: int = 300) -> np.ndarray:
+    """
+    Render one heatmap snapshot to an RGB frame.
+
+    Uses a bare Agg Figure instead of pyplot so it can run in worker processes.
+
+    Args:
+        snapshot (tuple): (utilization, title, vmin, vmax) from replay_utilization.
+        dpi (int): Resolution of the 8x6 inch frame.
+
+    Returns:
+        np.ndarray: (height, width, 3) uint8 frame.
+    """
+    utilization_array, title, vmin, vmax = snapshot
+    fig = Figure(figsize=(8, 6), dpi=dpi, layout="tight")
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    cax = ax.imshow(utilization_array, cmap=utilization_cmap(), interpolation="nearest", origin="lower", vmin=vmin, vmax=vmax)
+    ax.set_title(title)
+    ax.set_xlabel("Grid X Index")
+    ax.set_ylabel("Grid Y Index")
+    fig.colorbar(cax, ax=ax, label="Utilization")
+
+    default_fontsize = matplotlib.rcParams['font.size']  # 默認字體大小
+    small_fontsize = default_fontsize * 0.75  # 縮小到 80%
+    yStepNum, xStepNum = utilization_array.shape
+    for j in range(yStepNum):
+        for i in range(xStepNum):
+            ax.text(i, j, f"{utilization_array[j, i] * 100:.0f}", ha='center', va='center', color='black', fontsize=small_fontsize)
+
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())[:, :, :3].copy()
+
+def write_heatmap_animation(snapshots, output_path: str, workers: int, dpi: int = 300, duration: float = 0.2) -> int:
+    """
+    Render snapshots in a process pool and stream the frames to a GIF/MP4 writer.
+
+    At most 2 * workers frames are in flight, so memory stays bounded no
+    matter how many snapshots are produced. Frames are written in order.
+
+    Args:
+        snapshots: Iterable of snapshots from replay_utilization.
+        output_path (str): Output file, .gif or any video format of the imageio ffmpeg plugin.
+        workers (int): Number of rendering processes, 1 renders in this process.
+        dpi (int): Frame resolution passed to render_heatmap.
+        duration (float): Seconds per frame.
+
+    Returns:
+        int: Number of frames written.
+    """
+    if output_path.lower().endswith(".gif"):
+        # GIF-PIL encodes every frame on append (duration in seconds), the default
+        # pillow plugin would buffer all frames until close
+        writer = imageio.get_writer(output_path, format="GIF-PIL", mode="I", duration=duration, loop=0)
+    else:
+        writer = imageio.get_writer(output_path, fps=1.0 / duration, macro_block_size=1)
+
+    frame_num = 0
+    with writer:
+        if workers <= 1:
+            for snapshot in snapshots:
+                writer.append_data(render_heatmap(snapshot, dpi))
+                frame_num += 1
+            return frame_num
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for snapshot in snapshots:
+                pending.append(pool.submit(render_heatmap, snapshot, dpi))
+                if len(pending) >= 2 * workers:
+                    writer.append_data(pending.popleft().result())
+                    frame_num += 1
+            while pending:
+                writer.append_data(pending.popleft().result())
+                frame_num += 1
+    return frame_num
+
 def parse_arguments():
     """Parse command-line arguments using argparse."""
     parser = argparse.ArgumentParser(description="Process LG, OPT, and POST files for placement optimization.")
@@ -207,15 +377,14 @@ def parse_arguments():
     parser.add_argument("xStepNum", type=int, help="Number of grid steps in X direction.")
     parser.add_argument("yStepNum", type=int, help="Number of grid steps in Y direction.")
     parser.add_argument("stepCut", type=int, help="Step interval for saving intermediate heatmaps.")
+    parser.add_argument("--benchmark", action="store_true", help="Only replay the steps without rendering and report steps/sec.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes rendering heatmap frames.")
+    parser.add_argument("--dpi", type=int, default=300, help="Resolution of heatmap frames.")
+    parser.add_argument("--output", type=str, default=None, help="Output GIF/MP4 path (default: <lgFile name>.gif in the current folder).")
     return parser.parse_args()
 ###
 
 def main():
-    # 灰階的深淺降低幅度
-    colors = [(1, 1, 1), (1, 1, 0), (1, 0, 0)]  # 白色 -> 黃色 -> 紅色
-    positions = [0.0, 0.5, 1.0]  # 對應位置
-    custom_cmap = LinearSegmentedColormap.from_list("custom_red_yellow_white", list(zip(positions, colors)))
-
     # Parse command-line arguments
     args = parse_arguments()
     lgfile = args.lgfile
@@ -254,219 +423,40 @@ def main():
     y_step = (max_y - min_y) / yStepNum
 
     # Initialize grid utilization
-    grid_utilization = [[0.0 for _ in range(xStepNum)] for _ in range(yStepNum)]
-    grid_area = x_step * y_step
-
-    # Create a list to store frames for the GIF
-    gif_frames = []
+    grid_utilization = np.zeros((yStepNum, xStepNum), dtype=np.float64)
+    grid_origin = (min_x, min_y)
+    grid_step = (x_step, y_step)
 
     # Pre-opt utilization
     for component in components:
         if component.x + component.w > max_x or component.y + component.h > max_y:
             print(f"Component {component.name} exceeds bounds: x+w={component.x + component.w}, y+h={component.y + component.h}")
-        
-        startXidx = math.floor((component.x - min_x) / x_step)
-        endXidx = math.ceil((component.x + component.w - min_x) / x_step)
-        startYidx = math.floor((component.y - min_y) / y_step)
-        endYidx = math.ceil((component.y + component.h - min_y) / y_step)
-
-        for j in range(startYidx, endYidx):
-            grid_min_y = min_y + j * y_step
-            grid_max_y = grid_min_y + y_step
-            for i in range(startXidx, endXidx):
-                grid_min_x = min_x + i * x_step
-                grid_max_x = grid_min_x + x_step
-
-                overlap_min_x = max(component.x, grid_min_x)
-                overlap_max_x = min(component.x + component.w, grid_max_x)
-                overlap_min_y = max(component.y, grid_min_y)
-                overlap_max_y = min(component.y + component.h, grid_max_y)
-
-                if overlap_min_x <= overlap_max_x and overlap_min_y <= overlap_max_y:
-                    overlap_area = (overlap_max_x - overlap_min_x) * (overlap_max_y - overlap_min_y)
-                    grid_utilization[j][i] += overlap_area / grid_area
-
-    # Add initial heatmap to GIF frames
-    fig, ax = plt.subplots(figsize=(8, 6))
-    utilization_array = np.array(grid_utilization)
-    vmin, vmax = utilization_array.min(), utilization_array.max()
-    cax = ax.imshow(utilization_array, cmap=custom_cmap, interpolation="nearest", origin="lower", vmin=vmin, vmax=vmax)
-    #ax.set_title("Grid Utilization Heatmap")
-    ax.set_title(f"Grid Utilization Heatmap (Step {-1}, initial log layout)")
-    ax.set_xlabel("Grid X Index")
-    ax.set_ylabel("Grid Y Index")
-    fig.colorbar(cax, ax=ax, label="Utilization")
-
-    default_fontsize = plt.rcParams['font.size']  # 默認字體大小
-    small_fontsize = default_fontsize * 0.75  # 縮小到 80%
-    for j in range(yStepNum):
-            for i in range(xStepNum):
-                ax.text(i, j, f"{utilization_array[j, i] * 100:.0f}", ha='center', va='center', color='black', fontsize=small_fontsize)
-
-    #print(utilization_array)
-    #plt.show()
-
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=300, bbox_inches="tight")
-    buf.seek(0)
-    gif_frames.append(Image.open(buf).convert("RGB"))  # Convert to ensure consistency
-    buf.close()
-    plt.close(fig)
-
-    # Optimization steps
-    for k, cell in enumerate(banking_cells):
-        # Update grid utilization for deleted and moved cells
-        # ... (retain your existing logic for grid updates)
-        # 刪除 banked cells
-        for delname in cell.ff_list:
-            # 刪除利用率
-            for compo in components:
-                if compo.name == delname:
-                    startXidx = math.floor((compo.x-min_x)/x_step) #小
-                    endXidx = math.ceil((compo.x + compo.w-min_x)/x_step) # 大
-                    startYidx = math.floor((compo.y-min_y)/y_step)
-                    endYidx = math.ceil((compo.y + compo.h-min_y)/y_step)
-                    for j in range(startYidx, endYidx):
-                        grid_min_y = min_y + j * y_step
-                        grid_max_y = grid_min_y + y_step
-                        for i in range(startXidx, endXidx):
-                            grid_min_x = min_x + i * x_step
-                            grid_max_x = grid_min_x + x_step
-
-                            overlap_min_x = max(compo.x, grid_min_x)
-                            overlap_max_x = min(compo.x + compo.w, grid_max_x)
-                            overlap_min_y = max(compo.y, grid_min_y)
-                            overlap_max_y = min(compo.y + compo.h, grid_max_y)
-
-                            if overlap_min_x <= overlap_max_x and overlap_min_y <= overlap_max_y:
-                                overlap_area = (overlap_max_x - overlap_min_x) * (overlap_max_y - overlap_min_y)
-                                grid_utilization[j][i] -= overlap_area / grid_area # 改為 -=
-                                
-                                #print(f"Delete {delname} at ({compo.x}, {compo.y})")
-                    #刪除他
-                    components.remove(compo)
-                    break
-                
-
-        # 加入 new ff
-        if k < len(merged_ff_updates):
-            components.append(Component(cell.merged_name, merged_ff_updates[k].x, merged_ff_updates[k].y, cell.w, cell.h, False))
-            # 加入他的利用率
-            startXidx = math.floor((merged_ff_updates[k].x-min_x)/x_step) #小
-            endXidx = math.ceil((merged_ff_updates[k].x + cell.w-min_x)/x_step) # 大
-            startYidx = math.floor((merged_ff_updates[k].y-min_y)/y_step)
-            endYidx = math.ceil((merged_ff_updates[k].y + cell.h-min_y)/y_step)
-            for j in range(startYidx, endYidx):
-                grid_min_y = min_y + j * y_step
-                grid_max_y = grid_min_y + y_step
-                for i in range(startXidx, endXidx):
-                    grid_min_x = min_x + i * x_step
-                    grid_max_x = grid_min_x + x_step
-
-                    overlap_min_x = max(merged_ff_updates[k].x, grid_min_x)
-                    overlap_max_x = min(merged_ff_updates[k].x + cell.w, grid_max_x)
-                    overlap_min_y = max(merged_ff_updates[k].y, grid_min_y)
-                    overlap_max_y = min(merged_ff_updates[k].y + cell.h, grid_max_y)
-
-                    if overlap_min_x <= overlap_max_x and overlap_min_y <= overlap_max_y:
-                        overlap_area = (overlap_max_x - overlap_min_x) * (overlap_max_y - overlap_min_y)
-                        grid_utilization[j][i] += overlap_area / grid_area # 改為 +=
-
-                        #print (f"Add {cell.merged_name} at ({merged_ff_updates[k].x}, {merged_ff_updates[k].y})")
-
-        # 移動 ff
-        if k < len(merged_ff_updates):
-            for moved in merged_ff_updates[k].moved_cells:
-                for comp in components:
-                    if comp.name == moved.name:
-                        #刪除利用率
-                        startXidx = math.floor((comp.x-min_x)/x_step) #小
-                        endXidx = math.ceil((comp.x + comp.w-min_x)/x_step) # 大
-                        startYidx = math.floor((comp.y-min_y)/y_step)
-                        endYidx = math.ceil((comp.y + comp.h-min_y)/y_step)
-                        for j in range(startYidx, endYidx):
-                            grid_min_y = min_y + j * y_step
-                            grid_max_y = grid_min_y + y_step
-                            for i in range(startXidx, endXidx):
-                                grid_min_x = min_x + i * x_step
-                                grid_max_x = grid_min_x + x_step
-
-                                overlap_min_x = max(comp.x, grid_min_x)
-                                overlap_max_x = min(comp.x + comp.w, grid_max_x)
-                                overlap_min_y = max(comp.y, grid_min_y)
-                                overlap_max_y = min(comp.y + comp.h, grid_max_y)
-
-                                if overlap_min_x <= overlap_max_x and overlap_min_y <= overlap_max_y:
-                                    overlap_area = (overlap_max_x - overlap_min_x) * (overlap_max_y - overlap_min_y)
-                                    grid_utilization[j][i] -= overlap_area / grid_area # 改為 -=
-                                #print(f"Move - {moved.name} from ({comp.x}, {comp.y}) to ({moved.x}, {moved.y})")
-                        #移動
-                        comp.x = moved.x
-                        comp.y = moved.y
-                        #加入利用率
-                        startXidx = math.floor((comp.x-min_x)/x_step) #小
-                        endXidx = math.ceil((comp.x + comp.w-min_x)/x_step) # 大
-                        startYidx = math.floor((comp.y-min_y)/y_step)
-                        endYidx = math.ceil((comp.y + comp.h-min_y)/y_step)
-                        for j in range(startYidx, endYidx):
-                            grid_min_y = min_y + j * y_step
-                            grid_max_y = grid_min_y + y_step
-                            for i in range(startXidx, endXidx):
-                                grid_min_x = min_x + i * x_step
-                                grid_max_x = grid_min_x + x_step
-
-                                overlap_min_x = max(comp.x, grid_min_x)
-                                overlap_max_x = min(comp.x + compo.w, grid_max_x)
-                                overlap_min_y = max(comp.y, grid_min_y)
-                                overlap_max_y = min(comp.y + comp.h, grid_max_y)
-
-                                if overlap_min_x <= overlap_max_x and overlap_min_y <= overlap_max_y:
-                                    overlap_area = (overlap_max_x - overlap_min_x) * (overlap_max_y - overlap_min_y)
-                                    grid_utilization[j][i] += overlap_area / grid_area # 改為 +=
-                                    #print(f"Move + {moved.name} from ({comp.x}, {comp.y}) to ({moved.x}, {moved.y})")
-                        
-                        break
-        
-        # Add intermediate heatmap to GIF frames
-        if (k % stepCut == 0 and k > 0) or k == len(banking_cells) - 1:
-            fig, ax = plt.subplots(figsize=(8, 6))
-            utilization_array = np.array(grid_utilization)
-            vmin, vmax = utilization_array.min(), utilization_array.max()
-            cax = ax.imshow(utilization_array, cmap=custom_cmap, interpolation="nearest", origin="lower", vmin=0, vmax=1)
-            #ax.set_title("Grid Utilization Heatmap")
-            ax.set_title(f"Grid Utilization Heatmap (Step {k})")
-            ax.set_xlabel("Grid X Index")
-            ax.set_ylabel("Grid Y Index")
-            fig.colorbar(cax, ax=ax, label="Utilization")
-
-            default_fontsize = plt.rcParams['font.size']  # 默認字體大小
-            small_fontsize = default_fontsize * 0.75  # 縮小到 80%
-            for j in range(yStepNum):
-                for i in range(xStepNum):
-                    ax.text(i, j, f"{utilization_array[j, i] * 100:.0f}", ha='center', va='center', color='black', fontsize=small_fontsize)
-
-            buf = io.BytesIO()
-            fig.savefig(buf, format="png", dpi=300, bbox_inches="tight")
-            buf.seek(0)
-            gif_frames.append(Image.open(buf).convert("RGB"))  # Convert to ensure consistency
-            buf.close()
-            plt.close(fig)
+    rasterize_utilization(grid_utilization,
+                          [c.x for c in components], [c.y for c in components],
+                          [c.w for c in components], [c.h for c in components],
+                          grid_origin, grid_step)
+
+    # Optimization steps, the grid replay only emits snapshots and rendering is done by the writer
+    snapshots = replay_utilization(grid_utilization, grid_origin, grid_step, components,
+                                   banking_cells, merged_ff_updates, stepCut)
+
+    if args.benchmark:
+        start_time = time.perf_counter()
+        for _ in snapshots:
+            pass
+        elapsed = time.perf_counter() - start_time
+        print(f"Benchmark: {len(banking_cells)} steps in {elapsed:.3f} s, {len(banking_cells) / max(elapsed, 1e-9):.1f} steps/sec")
+        return
 
     # Save the GIF
-    filename_with_extension = os.path.basename(lgfile)
-    filename_without_extension = os.path.splitext(filename_with_extension)[0]
-    filename_without_extension += ".gif"
-    gif_output_path = os.path.join(utilGraphDir, filename_without_extension)
-    gif_frames[0].save(
-        gif_output_path,
-        save_all=True,
-        append_images=gif_frames[1:],
-        duration=200,  # Duration in milliseconds
-        loop=0
-    )
-    print(f"GIF saved to {gif_output_path}")
-
-
+    output_path = args.output
+    if output_path is None:
+        filename_with_extension = os.path.basename(lgfile)
+        filename_without_extension = os.path.splitext(filename_with_extension)[0]
+        filename_without_extension += ".gif"
+        output_path = os.path.join(utilGraphDir, filename_without_extension)
+    frame_num = write_heatmap_animation(snapshots, output_path, args.workers, dpi=args.dpi)
+    print(f"GIF saved to {output_path} ({frame_num} frames)")
 
 
 if __name__ == "__main__":
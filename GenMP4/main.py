@@ -1,15 +1,35 @@
 import argparse
+import ctypes
 from dataclasses import dataclass
+import os
+import queue
+import sys
+import threading
 import time
-from sortedcontainers import SortedDict
-import glfw
 import ffmpeg
 import numpy as np
-from OpenGL.GL import *
-from OpenGL.GLU import *
+try:
+    import glfw
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except ImportError: # headless nodes without OpenGL can still use -backend cpu
+    glfw = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from LgParser import load_lg, load_opt, load_post
 
 RESOLUTION = [1920, 1080]
 
+# adaptive frame schedule: most frames a single step may be held for, and weight of a step without displacement
+MAX_FRAME_HOLD = 8
+ADAPTIVE_MIN_WEIGHT = 0.1
+
+# frames waiting for ffmpeg, bounds memory when encoding is slower than rendering
+FRAME_QUEUE_SIZE = 8
+
+# dirty slots closer than this are uploaded as one span, fewer glBufferSubData calls for a few extra bytes
+DIRTY_SPAN_GAP = 64
+
 MERGE_COLOR = (0.0, 0.0, 1.0)
 ACTIVE_MERGE_COLOR = (0.0, 1.0, 1.0)
 NOTFIX_COLOR = (0.0, 1.0, 0.0)
@@ -24,8 +44,10 @@ REMOVE_COLOR = (1.0, 1.0, 0.0)
 ORIGINAL_MERGE_COLOR = (1.0, 0.0, 1.0)
 
 class Cell:
+    __slots__ = ('name', 'x', 'y', 'width', 'height', 'is_fix', 'is_merge', 'color', 'id')
+
     def __init__(self, name: str, x: float, y: float, width: float, height: float, 
-                 is_fix: bool, is_merge: bool, pos: int):
+                 is_fix: bool, is_merge: bool, id: int):
         self.name = name
         self.x = x
         self.y = y
@@ -34,10 +56,51 @@ class Cell:
         self.is_fix = is_fix
         self.is_merge = is_merge
         self.color = MERGE_COLOR if is_merge else (FIX_COLOR if is_fix else NOTFIX_COLOR)
-        self.pos = pos # index in visualization buffer
+        self.id = id # index in Canva.cell_slot
+
+# feed raw rgb24 frames to ffmpeg from a writer thread, so rendering the next frame overlaps encoding
+class FrameWriter:
+    def __init__(self, output_file: str, width: int, height: int, args):
+        self.process = (
+            ffmpeg
+            .input('pipe:0', format='rawvideo', pix_fmt='rgb24', s=f'{width}x{height}', framerate=args.framerate)
+            .filter('vflip') # vertical flip to convert opengl coordinate to normal coordinate
+            .output(output_file, pix_fmt=args.pix_fmt, vcodec=args.vcodec, crf=args.crf, preset=args.preset)
+            .overwrite_output() # override output if exist
+            .run_async(pipe_stdin=True) #input from stdin
+        )
+        self.queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            if self.error is None:
+                try:
+                    self.process.stdin.write(frame)
+                except Exception as e: # keep draining so write() never blocks, report in main thread
+                    self.error = e
+
+    # blocks only if FRAME_QUEUE_SIZE frames are already waiting
+    def write(self, frame):
+        if self.error is not None:
+            raise RuntimeError(f"ffmpeg writer failed: {self.error}")
+        self.queue.put(frame)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.process.stdin.close()
+        self.process.wait()
+        if self.error is not None:
+            raise RuntimeError(f"ffmpeg writer failed: {self.error}")
 
 class Canva:
-    def __init__(self, x0: float, y0: float, x1: float, y1: float, buffer_size: int, output_file: str, display: bool, args):
+    def __init__(self, x0: float, y0: float, x1: float, y1: float, buffer_size: int, cell_num: int, output_file: str, display: bool, args):
         self.x0 = x0
         self.x1 = x1
         self.y0 = y0
@@ -46,7 +109,16 @@ class Canva:
         RESOLUTION[0] = int(RESOLUTION[1] * (x1 - x0) / (y1 - y0))
         self.vertices = np.empty((buffer_size*8*3,), dtype=np.float32)
         self.vertices_color = np.empty((buffer_size*8*3,), dtype=np.float32)
+        # (slot, vertex, xyz/rgb) views of the flat buffers for batched updates
+        self.cell_vertices = self.vertices.reshape(buffer_size, 8, 3)
+        self.cell_colors = self.vertices_color.reshape(buffer_size, 8, 3)
+        # slots (ints or arrays) changed since last upload, only these ranges are sent to the VBOs
+        self.dirty_vertex_slots = []
+        self.dirty_color_slots = []
         self.vertex_num = 0
+        # slot table, slot -> cell id for the first vertex_num slots and cell id -> slot (-1 if not drawn)
+        self.slot_cell = np.full(buffer_size, -1, dtype=np.int64)
+        self.cell_slot = np.full(cell_num, -1, dtype=np.int64)
         self.merge_cell_init = False
         self.merge_cell_vertices = np.empty((4*3,), dtype=np.float32)
         self.merge_cell_vertices_color = np.array(ACTIVE_MERGE_COLOR*4, dtype=np.float32)
@@ -56,14 +128,8 @@ class Canva:
         self.video_out = False
         if output_file:
             self.video_out = True
-            self.process = (
-                ffmpeg
-                .input('pipe:0', format='rawvideo', pix_fmt='rgb24', s=f'{RESOLUTION[0]}x{RESOLUTION[1]}', framerate=args.framerate)
-                .filter('vflip') # vertical flip to convert opengl coordinate to normal coordinate
-                .output(output_file, pix_fmt=args.pix_fmt, vcodec=args.vcodec, crf=args.crf, preset=args.preset)
-                .overwrite_output() # override output if exist
-                .run_async(pipe_stdin=True) #input from stdin
-            )
+            self.writer = FrameWriter(output_file, *RESOLUTION, args)
+            self.initReadback()
 
         # setup draw function
         self.draw = self._drawAndSwapBuffer if display else self._draw
@@ -149,19 +215,50 @@ class Canva:
 
     def pushCell(self, cell: Cell):
         i = self.vertex_num
-        cell.pos = i
+        self.slot_cell[i] = cell.id
+        self.cell_slot[cell.id] = i
         self.vertex_num += 1
         z = -1. if cell.is_merge else 1.0
         self.setCellPosition(cell, z)
         self.setCellColor(cell)
+
+    def pushCells(self, cells: list[Cell]):
+        start = self.vertex_num
+        self.vertex_num += len(cells)
+        slots = np.arange(start, self.vertex_num)
+        ids = np.fromiter((cell.id for cell in cells), dtype=np.int64, count=len(cells))
+        self.slot_cell[slots] = ids
+        self.cell_slot[ids] = slots
+        self.setCellsPosition(slots,
+                              [cell.x for cell in cells], [cell.y for cell in cells],
+                              [cell.width for cell in cells], [cell.height for cell in cells],
+                              [-1. if cell.is_merge else 1. for cell in cells])
+        self.setCellsColor(slots, [cell.color for cell in cells])
     
+    # merge dirty slots into [begin, end) spans, slots closer than DIRTY_SPAN_GAP share a span
+    @staticmethod
+    def dirtySpans(dirty_slots):
+        slots = np.unique(np.concatenate([np.atleast_1d(np.asarray(s, dtype=np.int64)) for s in dirty_slots]))
+        breaks = np.flatnonzero(np.diff(slots) > DIRTY_SPAN_GAP) + 1
+        begins = slots[np.concatenate(([0], breaks))]
+        ends = slots[np.concatenate((breaks - 1, [len(slots) - 1]))] + 1
+        return zip(begins.tolist(), ends.tolist())
+
+    @staticmethod
+    def uploadSpans(vbo, cell_buffer, dirty_slots):
+        if not dirty_slots:
+            return
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        cell_bytes = cell_buffer[0].nbytes
+        for begin, end in Canva.dirtySpans(dirty_slots):
+            glBufferSubData(GL_ARRAY_BUFFER, begin * cell_bytes, (end - begin) * cell_bytes, cell_buffer[begin:end])
+        dirty_slots.clear()
+
     def updateVertexBuffer(self):
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo_vertices)
-        glBufferSubData(GL_ARRAY_BUFFER, 0, self.vertices.nbytes, self.vertices)  # Update the VBO with new vertices
+        self.uploadSpans(self.vbo_vertices, self.cell_vertices, self.dirty_vertex_slots)  # Update the VBO with changed vertices
 
     def updateColorBuffer(self):
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo_colors)
-        glBufferSubData(GL_ARRAY_BUFFER, 0, self.vertices_color.nbytes, self.vertices_color)  # Update the VBO with new colors
+        self.uploadSpans(self.vbo_colors, self.cell_colors, self.dirty_color_slots)  # Update the VBO with changed colors
 
     def updateAllBuffer(self):
         self.updateVertexBuffer()
@@ -170,30 +267,45 @@ class Canva:
     def popCell(self):
         #assert self.vertex_num > 0
         self.vertex_num -= 1
+        self.cell_slot[self.slot_cell[self.vertex_num]] = -1
+        self.slot_cell[self.vertex_num] = -1
+
+    # remove cell by swapping it with the last slot and popping the back, O(1)
+    def removeCell(self, cell: Cell):
+        self.swapCell(self.cell_slot[cell.id], self.vertex_num - 1)
+        self.popCell()
+
+    def slotsOf(self, cells: list[Cell]):
+        return self.cell_slot[np.fromiter((cell.id for cell in cells), dtype=np.int64, count=len(cells))]
 
     def swapCell(self, i, j):
         #assert i >= 0 and i < self.vertex_num
         #assert j >= 0 and i < self.vertex_num
         if i == j:
             return
-        i*=24
-        j*=24
-        self.vertices[i:i+24], self.vertices[j:j+24] = self.vertices[j:j+24].copy(), self.vertices[i:i+24].copy()
-        self.vertices_color[i:i+24], self.vertices_color[j:j+24] = self.vertices_color[j:j+24].copy(), self.vertices_color[i:i+24].copy()
+        # only one side needs a temporary copy
+        tmp = self.cell_vertices[i].copy()
+        self.cell_vertices[i] = self.cell_vertices[j]
+        self.cell_vertices[j] = tmp
+        tmp = self.cell_colors[i].copy()
+        self.cell_colors[i] = self.cell_colors[j]
+        self.cell_colors[j] = tmp
+        self.dirty_vertex_slots += (i, j)
+        self.dirty_color_slots += (i, j)
+        cell_i, cell_j = self.slot_cell[i], self.slot_cell[j]
+        self.slot_cell[i], self.slot_cell[j] = cell_j, cell_i
+        self.cell_slot[cell_i], self.cell_slot[cell_j] = j, i
 
     def setCellPosition(self, cell: Cell, z = 1.):
-        i = cell.pos
+        i = self.cell_slot[cell.id]
         #assert i >= 0 and i < self.vertex_num
         x = cell.x
         y = cell.y
         width = cell.width
         height = cell.height
         offset = i*8*3
-        #  6----5
-        # 7      4
-        # |      |
-        # 8      3
-        #  1----2
+        self.dirty_vertex_slots.append(i)
+        # same layout as setCellsPosition, kept scalar since single cell updates are common in detail mode
         self.vertices[offset:offset + 24] = [
             x, y, z,
             x + width, y, z,
@@ -205,6 +317,22 @@ class Canva:
             x, y, z
         ]
 
+    # set outline of many cells at once, slots/x/y/width/height are arrays of same length, z is scalar or array
+    def setCellsPosition(self, slots, x, y, width, height, z = 1.):
+        x = np.asarray(x, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32)
+        right = x + np.asarray(width, dtype=np.float32)
+        top = y + np.asarray(height, dtype=np.float32)
+        #  6----5
+        # 7      4
+        # |      |
+        # 8      3
+        #  1----2
+        self.cell_vertices[slots, :, 0] = np.stack((x, right, right, right, right, x, x, x), axis=1)
+        self.cell_vertices[slots, :, 1] = np.stack((y, y, y, top, top, top, top, y), axis=1)
+        self.cell_vertices[slots, :, 2] = np.reshape(z, (-1, 1))
+        self.dirty_vertex_slots.append(slots)
+
     def setMergeCell(self, cell: Cell):
         x = cell.x
         y = cell.y
@@ -222,15 +350,22 @@ class Canva:
             x, y + h, 0.0,
             x + w, y + h, 0.0,
         ]
+        self.updateMergeCellBuffer()
+
+    def updateMergeCellBuffer(self):
         # Update the VBO with new vertices
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_merge_cell_vertices)
         glBufferSubData(GL_ARRAY_BUFFER, 0, self.merge_cell_vertices.nbytes, self.merge_cell_vertices)
 
     def setCellColor(self, cell: Cell):
-        i = cell.pos
-        color = cell.color
-        offset = i*8*3
-        self.vertices_color[offset:offset+24] = color*8
+        i = self.cell_slot[cell.id]
+        self.cell_colors[i] = cell.color
+        self.dirty_color_slots.append(i)
+
+    # set color of many cells at once, colors is one rgb tuple or an array of rgb with same length as slots
+    def setCellsColor(self, slots, colors):
+        self.cell_colors[slots] = np.reshape(np.asarray(colors, dtype=np.float32), (-1, 1, 3))
+        self.dirty_color_slots.append(slots)
 
     def _draw(self):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -269,15 +404,134 @@ class Canva:
         self._draw()
         glfw.swap_buffers(self.window)
 
+    # two pixel pack buffers, frame N is read into one while frame N-1 is mapped from the other,
+    # so glReadPixels returns without waiting for the GPU
+    def initReadback(self):
+        self.frame_bytes = RESOLUTION[0] * RESOLUTION[1] * 3
+        self.pbos = glGenBuffers(2)
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_bytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.pbo_index = 0
+        self.pbo_pending = False
+
     # https://stackoverflow.com/questions/41126090/how-to-write-pyopengl-in-to-jpg-image
     def captureFrame(self):
         glPixelStorei(GL_PACK_ALIGNMENT, 1)
-        pixels = glReadPixels(0, 0, *RESOLUTION, GL_RGB, GL_UNSIGNED_BYTE)
-        self.process.stdin.write(pixels)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.pbo_index])
+        glReadPixels(0, 0, *RESOLUTION, GL_RGB, GL_UNSIGNED_BYTE, 0) # async copy into the pbo
+        self.pbo_index ^= 1
+        if self.pbo_pending:
+            self.writePendingFrame()
+        self.pbo_pending = True
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    # copy previous frame out of its pbo and hand it to the writer thread
+    def writePendingFrame(self):
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.pbo_index])
+        pointer = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        self.writer.write(ctypes.string_at(pointer, self.frame_bytes))
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
 
     def terminate(self):
-        self.process.stdin.close()
-        self.process.wait() 
+        if not self.video_out:
+            return
+        if self.pbo_pending:
+            self.pbo_index ^= 1 # last frame is in the other pbo
+            self.writePendingFrame()
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            self.pbo_pending = False
+        self.writer.close()
+
+# software backend, rasterize the same vertex buffers into a numpy framebuffer, no OpenGL context needed
+class CpuCanva(Canva):
+    def initOpenGL(self, display: bool):
+        if display:
+            raise RuntimeError("cpu backend can not render to screen, use -o instead")
+        # one packed rgbx uint32 per pixel so a pixel write is a single element store,
+        # row 0 at the bottom like glReadPixels, flipped by ffmpeg
+        self.framebuffer = np.empty((RESOLUTION[1], RESOLUTION[0]), dtype=np.uint32)
+        self.pixels = self.framebuffer.reshape(-1)
+        self.scale_x = RESOLUTION[0] / (self.x1 - self.x0)
+        self.scale_y = RESOLUTION[1] / (self.y1 - self.y0)
+
+    def initReadback(self):
+        pass
+
+    # rasterizer reads the cpu buffers directly, nothing to upload
+    def updateVertexBuffer(self):
+        self.dirty_vertex_slots.clear()
+
+    def updateColorBuffer(self):
+        self.dirty_color_slots.clear()
+
+    def updateMergeCellBuffer(self):
+        pass
+
+    @staticmethod
+    def packColors(colors):
+        rgb = np.rint(np.asarray(colors) * 255).astype(np.uint32)
+        return rgb[..., 0] | (rgb[..., 1] << 8) | (rgb[..., 2] << 16)
+
+    def toColumn(self, x):
+        return np.clip(((x - self.x0) * self.scale_x).astype(np.int32), 0, RESOLUTION[0] - 1)
+
+    def toRow(self, y):
+        return np.clip(((y - self.y0) * self.scale_y).astype(np.int32), 0, RESOLUTION[1] - 1)
+
+    # write spans of pixels in one scatter, span i starts at flat index start[i] and steps by stride[i],
+    # spans are painted in order so later spans cover earlier ones
+    def fillSpans(self, start, length, stride, colors):
+        total = int(length.sum())
+        if total == 0:
+            return
+        first = np.cumsum(length, dtype=np.int32) - length
+        index = np.repeat(start - first * stride, length)
+        index += np.arange(total, dtype=np.int32) * np.repeat(stride, length)
+        self.pixels[index] = np.repeat(colors, length)
+
+    # outline spans of cells in slots, 4 spans per cell: bottom, top, left, right
+    def outlineSpans(self, slots):
+        vertices = self.cell_vertices[slots]
+        left, bottom = self.toColumn(vertices[:, 0, 0]), self.toRow(vertices[:, 0, 1])
+        right, top = self.toColumn(vertices[:, 3, 0]), self.toRow(vertices[:, 3, 1])
+        width = RESOLUTION[0]
+        start = np.stack((bottom * width + left, top * width + left, bottom * width + left, bottom * width + right), axis=1)
+        length = np.stack((right - left + 1, right - left + 1, top - bottom + 1, top - bottom + 1), axis=1)
+        stride = np.broadcast_to(np.array([1, 1, width, width], dtype=np.int32), start.shape)
+        colors = np.repeat(self.packColors(self.cell_colors[slots, 0]), 4)
+        return start.ravel(), length.ravel(), stride.ravel(), colors
+
+    def _draw(self):
+        self.framebuffer.fill(self.packColors((1.0, 1.0, 1.0))) # white background
+
+        # painter's algorithm matching GL_LEQUAL depth test: far (larger z) first, equal z in buffer order
+        z = self.cell_vertices[:self.vertex_num, 0, 2]
+        order = np.argsort(-z, kind="stable")
+        behind = order[z[order] > 0.0] # merge cell is drawn at z = 0
+        self.fillSpans(*self.outlineSpans(behind))
+
+        if self.merge_cell_init:
+            quad = self.merge_cell_vertices.reshape(4, 3)
+            left, bottom = self.toColumn(quad[0, 0]), self.toRow(quad[0, 1])
+            right, top = self.toColumn(quad[3, 0]), self.toRow(quad[3, 1])
+            rows = np.arange(bottom, top + 1, dtype=np.int32)
+            self.fillSpans(rows * RESOLUTION[0] + left, np.full(len(rows), right - left + 1, dtype=np.int32),
+                           np.ones(len(rows), dtype=np.int32), np.full(len(rows), self.packColors(self.merge_cell_vertices_color[:3])))
+
+        self.fillSpans(*self.outlineSpans(order[len(behind):]))
+
+        if self.video_out:
+            self.captureFrame()
+
+    def captureFrame(self):
+        rgbx = self.framebuffer.view(np.uint8).reshape(*self.framebuffer.shape, 4)
+        self.writer.write(rgbx[:, :, :3].tobytes())
+
+    def terminate(self):
+        if self.video_out:
+            self.writer.close()
 
 @dataclass
 class OptimizeStep:
@@ -297,7 +551,7 @@ class Visualizer:
         self.start_time = time.time()
 
         self.cells: dict[str, Cell] = {}
-        self.cells_mapping: SortedDict[int, str] = SortedDict()
+        self.cell_num = 0 # ids handed out to cells, merged cells included
         self.display = display
 
         self.optimize_cases: list[OptimizeStep] = []
@@ -308,61 +562,86 @@ class Visualizer:
         self.detail_status = DetailStatus.SHOWRESULT
 
         self.n_step = 0
+        self.detail = detail
+
+        # frame schedule, every frame opportunity adds weight / every to credit and draws int(credit) frames
+        self.frame_every = 1.0
+        self.frame_weights = None
+        self.frame_credit = 0.0
+        self.frame_pending = False
 
         # setup step function
         self._step = self.detailStep if detail else self.normalStep
 
     def lgParser(self, lg_file: str):
-        with open(lg_file, "r") as input:
-            lg_lines = input.read().splitlines()
-        self.x0, self.y0, self.x1, self.y1 = map(float, lg_lines[2].strip().split(' ')[1:])
-        lg_lines = lg_lines[3:] 
-        for line in lg_lines:
-            if line.startswith("PlacementRows"):
-                pass
-            else:
-                name, x, y, width, height, fix = line.split(' ')
-                self.cells[name] = Cell(name, float(x), float(y), float(width), float(height), True if fix == "FIX" else False, False, -1)
+        placement = load_lg(lg_file)
+        self.x0, self.y0, self.x1, self.y1 = map(float, placement.die)
+        columns = (placement.x.tolist(), placement.y.tolist(), placement.w.tolist(), placement.h.tolist(), placement.fixed.tolist())
+        for name, x, y, width, height, fix in zip(placement.names, *columns):
+            self.cells[name] = Cell(name, float(x), float(y), float(width), float(height), fix, False, self.cell_num)
+            self.cell_num += 1
 
     def optimizeStepParser(self, opt_file, post_file):
-        with open(opt_file, "r") as file:
-            opt_lines = file.read().splitlines()
-        with open(post_file, "r") as file:
-            post_lines = file.read().splitlines()
-
-        post_line_idx = 0
-        for line in opt_lines:
-            parts = line.split(' ')
-
-            # <merge list> --> <name> <x> <y> <width> <height>
-            #    1:-6      -6    -5   -4   -3   -2       -1
-            name = parts[-5]
-            original_x, original_y, width, height = map(float, parts[-4:])
-            parts = parts[1:-6]
-
-            removed_cells = []
-            for part in parts:
-                removed_cells.append(part)
-
-            moved_cells = []
-            x, y = map(float, post_lines[post_line_idx].split(' '))
-            post_line_idx+=1
-            moved_num = int(post_lines[post_line_idx]) 
-            post_line_idx+=1
-            for i in range(moved_num):
-                parts = post_lines[post_line_idx].split(' ')
-                moved_cells.append((parts[0], tuple(map(float, parts[1:]))))
-                post_line_idx+=1
-
-            self.optimize_cases.append(OptimizeStep(removed_cells, x, y, 
-                                                    Cell(name, original_x, original_y, width, height, False, True, -1), moved_cells))
+        steps = load_opt(opt_file)
+        post = load_post(post_file)
+        columns = (post.x.tolist(), post.y.tolist(), steps.x.tolist(), steps.y.tolist(), steps.w.tolist(), steps.h.tolist())
+        for i, (x, y, original_x, original_y, width, height) in enumerate(zip(*columns)):
+            name = steps.merge_names[i]
+            cell_names, cell_xs, cell_ys = post.moved(i)
+            moved_cells = [(cell_name, (float(cell_x), float(cell_y))) for cell_name, cell_x, cell_y in zip(cell_names, cell_xs.tolist(), cell_ys.tolist())]
+            self.optimize_cases.append(OptimizeStep(steps.removed(i), float(x), float(y),
+                                                    Cell(name, float(original_x), float(original_y), float(width), float(height), False, True, self.cell_num), moved_cells))
+            self.cell_num += 1
+
+    # displacement of every step, merged cell from its .opt position plus all moved cells (like beta term of the cost)
+    def stepDisplacements(self):
+        position = {name: (cell.x, cell.y) for name, cell in self.cells.items()}
+        displacements = np.zeros(len(self.optimize_cases))
+        for i, optimizeStep in enumerate(self.optimize_cases):
+            added_cell = optimizeStep.added_cell
+            displacement = abs(optimizeStep.merge_x - added_cell.x) + abs(optimizeStep.merge_y - added_cell.y)
+            position[added_cell.name] = (optimizeStep.merge_x, optimizeStep.merge_y)
+            for cell_name, (cell_x, cell_y) in optimizeStep.moved_cells:
+                old_x, old_y = position.get(cell_name, (cell_x, cell_y))
+                displacement += abs(cell_x - old_x) + abs(cell_y - old_y)
+                position[cell_name] = (cell_x, cell_y)
+            displacements[i] = displacement
+        return displacements
+
+    # must be called before the first step, every: draw one frame per `every` opportunities,
+    # duration: choose every to get a video of about `duration` seconds, adaptive: weight steps by displacement
+    def initFrameSchedule(self, every: int, duration: float, framerate: int, adaptive: bool):
+        # frame opportunities (calls of step) per optimize step, detail mode is an upper bound
+        if self.detail:
+            opportunities = np.array([3 + len(optimizeStep.moved_cells) for optimizeStep in self.optimize_cases], dtype=np.float64)
+        else:
+            opportunities = np.ones(len(self.optimize_cases))
+
+        if adaptive and len(self.optimize_cases) > 0:
+            displacements = self.stepDisplacements()
+            mean = np.average(displacements, weights=opportunities) if opportunities.sum() > 0 else 0.0
+            if mean > 0:
+                weights = ADAPTIVE_MIN_WEIGHT + displacements / mean
+                # normalize so the number of frames only depends on every/duration
+                self.frame_weights = weights * opportunities.sum() / np.dot(weights, opportunities)
+
+        self.frame_every = float(every)
+        if duration:
+            self.frame_every = max(opportunities.sum() / (duration * framerate), 1e-9)
+
+    # number of frames to draw for current opportunity of step `index`, 0 skips rendering
+    def scheduleFrames(self, index: int):
+        weight = 1.0 if self.frame_weights is None else self.frame_weights[index]
+        self.frame_credit += weight / self.frame_every
+        frames = int(self.frame_credit)
+        self.frame_credit -= frames
+        return min(frames, MAX_FRAME_HOLD) if self.frame_weights is not None else frames
 
     def initCanva(self,  out_file: str, args):
-        self.canva = Canva(self.x0, self.y0, self.x1, self.y1, len(self.cells) + 10, out_file, self.display, args)
+        canva_class = CpuCanva if args.backend == 'cpu' else Canva
+        self.canva = canva_class(self.x0, self.y0, self.x1, self.y1, len(self.cells) + 10, self.cell_num, out_file, self.display, args)
 
-        for cell in self.cells.values():
-            self.canva.pushCell(cell)
-            self.cells_mapping[cell.pos] = cell.name
+        self.canva.pushCells(list(self.cells.values()))
         self.canva.updateAllBuffer()
 
     def isOverlap(self, cell1: Cell, cell2: Cell):
@@ -372,16 +651,7 @@ class Visualizer:
                cell1.y + cell1.height > cell2.y
     
     def removeCell(self, cell_name: str):
-        last_cell_idx, last_cell_name = self.cells_mapping.peekitem(-1)
-        cell = self.cells[cell_name]
-
-        # remove current cell by swap back to current and remove back
-        self.canva.swapCell(last_cell_idx, cell.pos)
-        self.canva.popCell()
-        self.cells_mapping[cell.pos] = last_cell_name
-        self.cells[last_cell_name].pos = cell.pos
-
-        del self.cells_mapping[last_cell_idx]
+        self.canva.removeCell(self.cells[cell_name])
         del self.cells[cell_name]
 
     # step for opt
@@ -391,9 +661,6 @@ class Visualizer:
         if index > 0:
             prev_cell = self.cells[self.optimize_cases[index-1].added_cell.name]
             self.canva.pushCell(prev_cell)
-            idx = prev_cell.pos
-            self.cells_mapping[idx] = prev_cell.name
-            self.cells[prev_cell.name].pos = idx
 
         # remove merged cell
         for cell_name in optimizeStep.removed_cells:
@@ -405,11 +672,14 @@ class Visualizer:
         optimizeStep.added_cell.y = optimizeStep.merge_y
 
         # move all cell
-        for cell_name, (cell_x, cell_y) in optimizeStep.moved_cells:
-            cell = self.cells[cell_name]
+        moved = [self.cells[cell_name] for cell_name, _ in optimizeStep.moved_cells]
+        for cell, (_, (cell_x, cell_y)) in zip(moved, optimizeStep.moved_cells):
             cell.x = cell_x
             cell.y = cell_y
-            self.canva.setCellPosition(cell)
+        if moved:
+            self.canva.setCellsPosition(self.canva.slotsOf(moved),
+                                        [cell.x for cell in moved], [cell.y for cell in moved],
+                                        [cell.width for cell in moved], [cell.height for cell in moved])
 
         self.canva.updateAllBuffer()
         return True
@@ -432,9 +702,6 @@ class Visualizer:
                 optimizeStep.added_cell.color = ORIGINAL_MERGE_COLOR
                 # draw merge cell on oringal position
                 self.canva.pushCell(optimizeStep.added_cell)
-                idx = optimizeStep.added_cell.pos
-                self.cells_mapping[idx] = name
-                self.cells[name].pos = idx
 
                 self.illegal_cells.append((name, (optimizeStep.merge_x, optimizeStep.merge_y)))
 
@@ -484,19 +751,22 @@ class Visualizer:
                     cell = self.cells[cell_name]
                     cell.x = cell_x
                     cell.y = cell_y
-                    cell.color = LEGAL_COLOR
-                    self.canva.setCellPosition(cell, -0.7)
-                    self.canva.setCellColor(cell)
                     self.prev_moved_cells.append(cell)
                 self.canva.merge_cell_init = False # don't draw current cell
 
                 # reset color and z index for prev moved cell
+                # (cells moved just above are overwritten here as well, so they are not set on their own)
                 for cell in self.prev_moved_cells:
                     cell.color = MERGE_COLOR if cell.is_merge else NOTFIX_COLOR
-                    self.canva.setCellColor(cell)
-
-                    z = -0.9 if cell.is_merge else 1.
-                    self.canva.setCellPosition(cell, z) # use to reset z
+                # skip cells removed in this step, they have no slot anymore
+                cells = [cell for cell in self.prev_moved_cells if self.canva.cell_slot[cell.id] >= 0]
+                if cells:
+                    slots = self.canva.slotsOf(cells)
+                    self.canva.setCellsColor(slots, [cell.color for cell in cells])
+                    self.canva.setCellsPosition(slots,
+                                                [cell.x for cell in cells], [cell.y for cell in cells],
+                                                [cell.width for cell in cells], [cell.height for cell in cells],
+                                                [-0.9 if cell.is_merge else 1. for cell in cells]) # use to reset z
                 self.prev_moved_cells = []
 
                 self.detail_status = DetailStatus.MERGE
@@ -505,15 +775,22 @@ class Visualizer:
 
     # return finish or not
     def step(self):
-        finish = self._step(self.n_step)
+        index = self.n_step
+        finish = self._step(index)
         if finish:
             # move to next cases
             self.n_step += 1
             if self.n_step == len(self.optimize_cases):
+                if self.frame_pending: # last frames were skipped, show final state once
+                    self.canva.draw()
                 self.terminate()
                 return True
 
-        self.canva.draw()
+        # state is always updated, only scheduled frames are rendered and encoded
+        frames = self.scheduleFrames(index)
+        for _ in range(frames):
+            self.canva.draw()
+        self.frame_pending = frames == 0
 
         return False
 
@@ -531,6 +808,12 @@ if __name__ == '__main__':
     parser.add_argument('-o', type=str, help="output file")
     parser.add_argument('-display', action='store_true', help="render screen")
     parser.add_argument('-detail', action='store_true', help="show process of every cell in legalization")
+    parser.add_argument('-every', type=int, default=1, help="render one frame every N frames, the state is still updated every step")
+    parser.add_argument('-duration', type=float, help="target video length in seconds, overrides -every (detail mode may end up shorter, the frame count is estimated from an upper bound)")
+    parser.add_argument('-adaptive', action='store_true',
+                        help="skip frames in steps with little displacement and hold frames (up to %d) on large ones" % MAX_FRAME_HOLD)
+    parser.add_argument('-backend', type=str, default='opengl', choices=['opengl', 'cpu'],
+                        help="opengl renders with GLFW/OpenGL, cpu rasterizes with numpy and needs neither a GPU nor a display (only with -o)")
     # ffmpeg format
     parser.add_argument('-pix_fmt', type=str, default='yuv444p', help="ffmpeg option, pixel format")
     parser.add_argument('-framerate', type=int, default=60, help="ffmpeg option, fps")
@@ -544,6 +827,14 @@ if __name__ == '__main__':
                                 0 for lossless, 18 for visually lossless in h264. 
                                 ffmpeg default value is 23 for h264, 28 for h265""")
     args = parser.parse_args()   
+    if args.backend == 'cpu' and (args.display or not args.o):
+        parser.error("-backend cpu needs -o and can not be used with -display")
+    if args.every < 1:
+        parser.error("-every must be at least 1")
+    if args.duration is not None and args.duration <= 0:
+        parser.error("-duration must be positive")
+    if args.backend == 'opengl' and glfw is None:
+        parser.error("GLFW/PyOpenGL are not available, use -backend cpu")
     lg_file = args.lg 
     opt_file = args.opt
     post_file = args.postlg
@@ -558,6 +849,7 @@ if __name__ == '__main__':
     visualizer = Visualizer(detail, display)
     visualizer.lgParser(lg_file)
     visualizer.optimizeStepParser(opt_file, post_file)
+    visualizer.initFrameSchedule(args.every, args.duration, args.framerate, args.adaptive)
     visualizer.initCanva(output_file, args)
 
     if display:
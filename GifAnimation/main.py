@@ -1,65 +1,47 @@
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PatchCollection, PolyCollection
+from matplotlib.colors import to_rgba
 import numpy as np
 from tqdm import tqdm
 import imageio
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from LgParser import load_lg, load_opt, iter_post_deltas
 
 def parse_lg_file(file_path):
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-    die_size = None
-    blocks = []
-    rows = []
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith("#"): continue
-        fields = line.split()
-        if line.startswith("DieSize") and len(fields) == 5:
-            _, x1, y1, x2, y2 = fields
-            die_size = (int(x1), int(y1), int(x2), int(y2))
-        elif line.startswith("PlacementRows") and len(fields) == 6:
-            _, startX, startY, siteWidth, siteHeight, totalNumOfSites = fields
-            rows.append((int(startX), int(startY), int(siteWidth), int(siteHeight), int(totalNumOfSites)))
-        elif len(fields) == 6 and fields[5] in ["FIX", "NOTFIX"]:
-            name, x, y, width, height, fix_status = fields
-            blocks.append((name, int(x), int(y), int(width), int(height), fix_status))
-    return die_size, blocks, rows
+    placement = load_lg(file_path)
+    columns = (placement.x.tolist(), placement.y.tolist(), placement.w.tolist(), placement.h.tolist(), placement.fixed.tolist())
+    blocks = [
+        (name, x, y, width, height, "FIX" if fixed else "NOTFIX")
+        for name, x, y, width, height, fixed in zip(placement.names, *columns)
+    ]
+    rows = [tuple(row) for row in placement.rows.tolist()]
+    return placement.die, blocks, rows
 
 def parse_opt_file(file_path):
+    opt_steps = load_opt(file_path)
+    columns = (opt_steps.x.tolist(), opt_steps.y.tolist(), opt_steps.w.tolist(), opt_steps.h.tolist())
     steps = []
-    with open(file_path, "r") as f:
-        for line in f:
-            if line.startswith("Banking_Cell:"):
-                parts = line.strip().split("-->")
-                ff_list = parts[0].replace("Banking_Cell:", "").strip().split()
-                merged_info = parts[1].strip().split()
-                steps.append({
-                    'to_remove': ff_list,
-                    'new_cell': {
-                        'name': merged_info[0],
-                        'x': int(merged_info[1]),
-                        'y': int(merged_info[2]),
-                        'width': int(merged_info[3]),
-                        'height': int(merged_info[4])
-                    }
-                })
+    for i, (name, x, y, width, height) in enumerate(zip(opt_steps.merge_names, *columns)):
+        steps.append({
+            'to_remove': opt_steps.removed(i),
+            'new_cell': {
+                'name': name,
+                'x': x,
+                'y': y,
+                'width': width,
+                'height': height
+            }
+        })
     return steps
 
-def parse_post_file(file_path):
-    results = []
-    with open(file_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"): continue
-            fields = line.split()
-            if len(fields) >= 2:
-                results.append({
-                    'merged_position': (int(fields[0]), int(fields[1])),
-                    'moved_cells': []
-                })
-    return results
+def parse_post_file(file_path, name_index):
+    """逐步讀取 _post.lg，每次產生一個 PostDelta (合併後位置 x, y 與被移動 cells 的 index/座標陣列)"""
+    return iter_post_deltas(file_path, name_index)
 
 def draw_static_elements(ax, rows, die_size):
     row_patches = []
@@ -75,7 +57,34 @@ def draw_static_elements(ax, rows, die_size):
     ax.add_collection(collection)
 
 
-def create_animation(die_size, initial_blocks, rows, opt_steps, post_results, output_path='layout_optimization.gif'):
+BLOCK_COLORS = {"FIX": "#FF4444", "NOTFIX": "#4444FF", "MERGED": "#44FF44"}
+BLOCK_KINDS = ("FIX", "NOTFIX", "MERGED")
+
+def block_vertices(x, y, width, height):
+    """將 x, y, width, height 陣列轉成 PolyCollection 用的 (N, 4, 2) 頂點陣列"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    right = x + width
+    top = y + height
+    verts = np.empty((len(x), 4, 2))
+    verts[:, 0, 0], verts[:, 0, 1] = x, y
+    verts[:, 1, 0], verts[:, 1, 1] = right, y
+    verts[:, 2, 0], verts[:, 2, 1] = right, top
+    verts[:, 3, 0], verts[:, 3, 1] = x, top
+    return verts
+
+def block_colors(kinds, alpha=0.8):
+    """kinds 為 BLOCK_KINDS 的 index 陣列"""
+    palette = np.array([to_rgba(BLOCK_COLORS[kind], alpha) for kind in BLOCK_KINDS])
+    return palette[kinds]
+
+def open_frame_writer(output_path, fps):
+    """GIF 用 GIF-PIL 逐幀編碼寫入；其他副檔名 (如 .mp4) 透過 ffmpeg pipe 寫入，需安裝 imageio-ffmpeg"""
+    if output_path.lower().endswith(".gif"):
+        return imageio.get_writer(output_path, format="GIF-PIL", mode="I", duration=1.0 / fps, loop=0)
+    return imageio.get_writer(output_path, fps=fps, macro_block_size=1)
+
+def create_animation(die_size, initial_blocks, rows, opt_steps, post_file, output_path='layout_optimization.gif'):
     plt.style.use('fast')
     
     # 減小圖片尺寸
@@ -84,7 +93,6 @@ def create_animation(die_size, initial_blocks, rows, opt_steps, post_results, ou
     
     print("Generating layout animation:")
     
-    frames = []
     total_steps = len(opt_steps)
     
     num_samples = 30
@@ -100,90 +108,104 @@ def create_animation(die_size, initial_blocks, rows, opt_steps, post_results, ou
     y_margin = y_range * margin
     
     legend_elements = [
-        patches.Patch(facecolor="#FF4444", label="FIX"),
-        patches.Patch(facecolor="#4444FF", label="NOTFIX"),
-        patches.Patch(facecolor="#44FF44", label="MERGED")
+        patches.Patch(facecolor=BLOCK_COLORS["FIX"], label="FIX"),
+        patches.Patch(facecolor=BLOCK_COLORS["NOTFIX"], label="NOTFIX"),
+        patches.Patch(facecolor=BLOCK_COLORS["MERGED"], label="MERGED")
     ]
     
-    def set_plot_limits():
-        ax.set_xlim(die_size[0] - x_margin, die_size[2] + x_margin)
-        ax.set_ylim(die_size[1] - y_margin, die_size[3] + y_margin)
-        ax.set_aspect('equal', adjustable='box')
+    ax.set_xlim(die_size[0] - x_margin, die_size[2] + x_margin)
+    ax.set_ylim(die_size[1] - y_margin, die_size[3] + y_margin)
+    ax.set_aspect('equal', adjustable='box')
     
-    # 創建臨時文件夾存放幀
-    import tempfile
-    import os
-    temp_dir = tempfile.mkdtemp()
+    # 所有 cells 的狀態陣列，合併產生的 cells 依序接在初始 cells 後面
+    capacity = len(initial_blocks) + total_steps
+    cell_x = np.zeros(capacity, dtype=np.int64)
+    cell_y = np.zeros(capacity, dtype=np.int64)
+    cell_w = np.zeros(capacity, dtype=np.int64)
+    cell_h = np.zeros(capacity, dtype=np.int64)
+    cell_kind = np.zeros(capacity, dtype=np.int64)
+    for idx, (_, x, y, width, height, kind) in enumerate(initial_blocks):
+        cell_x[idx], cell_y[idx], cell_w[idx], cell_h[idx] = x, y, width, height
+        cell_kind[idx] = BLOCK_KINDS.index(kind)
+    cell_count = len(initial_blocks)
+    name_index = {block[0]: idx for idx, block in enumerate(initial_blocks)}
     
-    try:
+    # 靜態圖層：placement rows 與 FIX cells 只畫一次，之後當作背景重複使用
+    draw_static_elements(ax, rows, die_size)
+    fixed = np.flatnonzero(cell_kind[:cell_count] == BLOCK_KINDS.index("FIX"))
+    ax.add_collection(PolyCollection(block_vertices(cell_x[fixed], cell_y[fixed], cell_w[fixed], cell_h[fixed]),
+                                     facecolors=block_colors(cell_kind[fixed]), edgecolors="face"))
+    ax.legend(handles=legend_elements, 
+             loc='center left', 
+             bbox_to_anchor=(1.02, 0.5),
+             fontsize=16)
+    
+    # 動態圖層：可移動的 cells 與標題，每幀只更新頂點與顏色
+    cell_layer = PolyCollection(np.empty((0, 4, 2)), edgecolors="face", animated=True)
+    ax.add_collection(cell_layer)
+    title_text = ax.set_title("", fontsize=20, pad=20)
+    title_text.set_animated(True)
+    
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    
+    # 目前佈局狀態，只在取樣之間套用新增的步驟 (FIX cells 不會被合併或移動，只保留在靜態圖層)
+    alive = np.zeros(capacity, dtype=bool)
+    alive[:cell_count] = cell_kind[:cell_count] != BLOCK_KINDS.index("FIX")
+    post_steps = parse_post_file(post_file, name_index)
+    applied_steps = 0
+    
+    # 幀直接從 Agg canvas 取出並串流寫入，記憶體中只保留目前這一幀
+    writer = open_frame_writer(output_path, fps=5)
+    
+    with writer:
         for i, step in enumerate(tqdm(sample_steps, desc="Generating frames")):
-            ax.clear()
-            set_plot_limits()
-            draw_static_elements(ax, rows, die_size)
-            
-            current_blocks = initial_blocks.copy()
-            
-            blocks_to_remove = set()
-            merged_blocks = []
-            for step_idx in range(step):
-                if step_idx < len(opt_steps):
-                    blocks_to_remove.update(opt_steps[step_idx]['to_remove'])
-                    new_cell = opt_steps[step_idx]['new_cell']
-                    merged_pos = post_results[step_idx]['merged_position']
-                    merged_blocks.append((
-                        new_cell['name'],
-                        merged_pos[0],
-                        merged_pos[1],
-                        new_cell['width'],
-                        new_cell['height'],
-                        'MERGED'
-                    ))
-            
-            current_blocks = [b for b in current_blocks if b[0] not in blocks_to_remove] + merged_blocks
-            
-            patches_list = [
-                patches.Rectangle(
-                    (block[1], block[2]), block[3], block[4],
-                    color="#FF4444" if block[5] == "FIX" else "#4444FF" if block[5] == "NOTFIX" else "#44FF44",
-                    alpha=0.8
-                )
-                for block in current_blocks
-            ]
-            
-            collection = PatchCollection(patches_list, match_original=True)
-            ax.add_collection(collection)
+            for step_idx in range(applied_steps, min(step, len(opt_steps))):
+                for name in opt_steps[step_idx]['to_remove']:
+                    idx = name_index.get(name)
+                    if idx is not None:
+                        alive[idx] = False
+                new_cell = opt_steps[step_idx]['new_cell']
+                delta = next(post_steps, None)
+                idx = cell_count
+                cell_count += 1
+                name_index[new_cell['name']] = idx
+                cell_x[idx] = delta.x if delta is not None else new_cell['x']
+                cell_y[idx] = delta.y if delta is not None else new_cell['y']
+                cell_w[idx], cell_h[idx] = new_cell['width'], new_cell['height']
+                cell_kind[idx] = BLOCK_KINDS.index("MERGED")
+                alive[idx] = True
+                if delta is not None and len(delta):
+                    # legalizer 造成的位移
+                    valid = delta.moved_index >= 0
+                    cell_x[delta.moved_index[valid]] = delta.moved_x[valid]
+                    cell_y[delta.moved_index[valid]] = delta.moved_y[valid]
+            applied_steps = max(applied_steps, step)
             
-            ax.legend(handles=legend_elements, 
-                     loc='center left', 
-                     bbox_to_anchor=(1.02, 0.5),
-                     fontsize=16)
+            shown = np.flatnonzero(alive[:cell_count])
+            cell_layer.set_verts(block_vertices(cell_x[shown], cell_y[shown], cell_w[shown], cell_h[shown]))
+            cell_layer.set_facecolor(block_colors(cell_kind[shown]))
             
             progress = (step / total_steps) * 100
             if step == total_steps:
                 title = "Final Layout (100%)"
             else:
                 title = f"Layout Progress: {progress:.1f}% (Step {step}/{total_steps})"
-            ax.set_title(title, fontsize=20, pad=20)
+            title_text.set_text(title)
             
-            # 保存為臨時文件
-            temp_file = os.path.join(temp_dir, f'frame_{i:03d}.png')
-            plt.savefig(temp_file, bbox_inches='tight', pad_inches=0.1)
-            frames.append(imageio.imread(temp_file))
+            fig.canvas.restore_region(background)
+            ax.draw_artist(cell_layer)
+            ax.draw_artist(title_text)
+            
+            frame = np.asarray(fig.canvas.buffer_rgba())[:, :, :3]
+            writer.append_data(frame)
             
             if step == total_steps:
                 for _ in range(5):
-                    frames.append(frames[-1])
-        
-        plt.close()
-        
-        print(f"\nSaving animation to {output_path}...")
-        imageio.mimsave(output_path, frames, fps=5, loop=0)
-        print("Animation saved successfully!")
-        
-    finally:
-        # 清理臨時文件
-        import shutil
-        shutil.rmtree(temp_dir)
+                    writer.append_data(frame)
+    
+    plt.close()
+    print(f"\nAnimation saved to {output_path}")
 
 def main():
     parser = argparse.ArgumentParser(description='Layout Optimization Animation Generator')
@@ -195,7 +217,7 @@ def main():
     parser.add_argument('--post', type=str, required=True,
                         help='Input post file path')
     parser.add_argument('--output', type=str, default='layout_optimization.gif',
-                        help='Output GIF file path (default: layout_optimization.gif)')
+                        help='Output GIF (or .mp4 with imageio-ffmpeg) file path (default: layout_optimization.gif)')
     
     args = parser.parse_args()
     
@@ -203,9 +225,8 @@ def main():
         print(f"Reading files...")
         die_size, blocks, rows = parse_lg_file(args.lg)
         opt_steps = parse_opt_file(args.opt)
-        post_results = parse_post_file(args.post)
         
-        create_animation(die_size, blocks, rows, opt_steps, post_results, output_path=args.output)
+        create_animation(die_size, blocks, rows, opt_steps, args.post, output_path=args.output)
         
     except FileNotFoundError as e:
         print(f"Error: Could not find file - {e.filename}")
@@ -0,0 +1,9 @@
+from .parser import (Placement, OptSteps, PostSteps, PostDelta, read_lg, read_opt, read_post, iter_post, iter_post_deltas,
+                     index_post, read_post_at)
+from .cache import load_lg, load_opt, load_post, cache_path
+
+__all__ = [
+    "Placement", "OptSteps", "PostSteps", "PostDelta", "read_lg", "read_opt", "read_post", "iter_post",
+    "iter_post_deltas", "index_post", "read_post_at",
+    "load_lg", "load_opt", "load_post", "cache_path",
+]
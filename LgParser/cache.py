@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from .parser import Placement, OptSteps, PostSteps, read_lg, read_opt, read_post
+
+CACHE_MAGIC = b"LGCACHE1"
+CACHE_VERSION = 1
+CACHE_DIR_NAME = "__lgcache__"
+ALIGNMENT = 64
+
+# kind -> (store class, text parser, array columns, name tables, scalars)
+_KINDS = {
+    "lg": (Placement, read_lg, ("x", "y", "w", "h", "fixed", "rows"), ("names",), ("alpha", "beta", "die")),
+    "opt": (OptSteps, read_opt, ("x", "y", "w", "h", "remove_offsets"), ("merge_names", "remove_names"), ()),
+    "post": (PostSteps, read_post, ("x", "y", "move_offsets", "move_x", "move_y"), ("move_names",), ()),
+}
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_info(file_path):
+    stat = os.stat(file_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def cache_path(file_path, cache_dir=None):
+    """Return the snapshot path of a source file, by default <dir>/__lgcache__/<name>.npc."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, os.path.basename(file_path) + ".npc")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_snapshot(snapshot_path, kind, store, source):
+    """
+    Write a parsed store as a binary snapshot.
+
+    Layout: magic, 8-byte header length, JSON header, then every column and
+    name table as a raw block aligned to 64 bytes so it can be memory-mapped.
+
+    Args:
+        snapshot_path (str): Output path of the snapshot.
+        kind (str): One of "lg", "opt" or "post".
+        store: Placement, OptSteps or PostSteps to save.
+        source (dict): Source file mtime_ns, size and sha1 kept in the header.
+    """
+    _, _, columns, name_tables, scalars = _KINDS[kind]
+    blocks = []
+    for column in columns:
+        array = np.ascontiguousarray(getattr(store, column))
+        blocks.append((column, array.dtype.str, list(array.shape), array.tobytes()))
+    for table in name_tables:
+        names = getattr(store, table)
+        blocks.append((table, "names", [len(names)], "\n".join(names).encode("utf-8")))
+
+    header = {
+        "version": CACHE_VERSION,
+        "kind": kind,
+        "source": source,
+        "scalars": {scalar: getattr(store, scalar) for scalar in scalars},
+        "blocks": {},
+    }
+    # offsets are relative to the start of the data section
+    offset = 0
+    for name, dtype, shape, data in blocks:
+        header["blocks"][name] = [dtype, shape, offset, len(data)]
+        offset = _align(offset + len(data))
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(CACHE_MAGIC) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CACHE_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, _, _, data in blocks:
+            f.seek(data_start + header["blocks"][name][2])
+            f.write(data)
+    os.replace(tmp_path, snapshot_path)
+
+
+def _read_header(snapshot_path):
+    with open(snapshot_path, "rb") as f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None, 0
+        header_size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_size))
+    if not isinstance(header, dict) or header.get("version") != CACHE_VERSION:
+        return None, 0
+    return header, _align(len(CACHE_MAGIC) + 8 + header_size)
+
+
+def load_snapshot(snapshot_path, kind, header, data_start):
+    """
+    Map a snapshot back into a store without parsing.
+
+    Array columns are read-only views on a np.memmap of the snapshot, copy
+    them before modifying. Name tables are decoded into interned strings.
+
+    Raises:
+        ValueError: A block lies beyond the end of a truncated snapshot.
+    """
+    store_class, _, columns, name_tables, scalars = _KINDS[kind]
+    store = store_class()
+    buffer = np.memmap(snapshot_path, dtype=np.uint8, mode="r")
+    for name, (_, _, offset, size) in header["blocks"].items():
+        if offset < 0 or size < 0 or data_start + offset + size > len(buffer):
+            raise ValueError(f"block {name} ends past the end of the snapshot")
+    for scalar in scalars:
+        value = header["scalars"][scalar]
+        setattr(store, scalar, tuple(value) if isinstance(value, list) else value)
+    for column in columns:
+        dtype, shape, offset, size = header["blocks"][column]
+        begin = data_start + offset
+        setattr(store, column, buffer[begin:begin + size].view(np.dtype(dtype)).reshape(shape))
+    for table in name_tables:
+        _, (count,), offset, size = header["blocks"][table]
+        begin = data_start + offset
+        names = bytes(buffer[begin:begin + size]).decode("utf-8").split("\n") if count else []
+        setattr(store, table, list(map(sys.intern, names)))
+    if kind == "lg":
+        store.name_index = {name: i for i, name in enumerate(store.names)}
+    return store
+
+
+def _load(kind, file_path, cache_dir=None):
+    snapshot_path = cache_path(file_path, cache_dir)
+    source = _source_info(file_path)
+    header = None
+    if os.path.exists(snapshot_path):
+        try:
+            header, data_start = _read_header(snapshot_path)
+        except (OSError, ValueError):
+            header = None
+
+    if header is not None and header.get("kind") == kind:
+        # a truncated or corrupt snapshot is rebuilt like a stale one
+        try:
+            cached = header["source"]
+            if cached["mtime_ns"] == source["mtime_ns"] and cached["size"] == source["size"]:
+                return load_snapshot(snapshot_path, kind, header, data_start)
+            # touched but maybe not changed, the content hash decides
+            source["sha1"] = _file_hash(file_path)
+            if cached["size"] == source["size"] and cached["sha1"] == source["sha1"]:
+                store = load_snapshot(snapshot_path, kind, header, data_start)
+                _try_save(snapshot_path, kind, store, source)
+                return store
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[LgParser] Rebuilding cache {snapshot_path}: {e}")
+
+    store = _KINDS[kind][1](file_path)
+    source.setdefault("sha1", _file_hash(file_path))
+    _try_save(snapshot_path, kind, store, source)
+    return store
+
+
+def _try_save(snapshot_path, kind, store, source):
+    # the cache is an optimization only, a read-only data folder still works
+    try:
+        save_snapshot(snapshot_path, kind, store, source)
+    except OSError as e:
+        print(f"[LgParser] Skipping cache {snapshot_path}: {e}")
+
+
+def load_lg(file_path, cache_dir=None):
+    """
+    Load an .lg file through the binary snapshot cache.
+
+    Args:
+        file_path (str): Path to the LG file.
+        cache_dir (str): Snapshot folder, defaults to __lgcache__ next to the file.
+
+    Returns:
+        Placement: Same content as read_lg, with read-only memory-mapped columns.
+    """
+    return _load("lg", file_path, cache_dir)
+
+
+def load_opt(file_path, cache_dir=None):
+    """
+    Load an .opt file through the binary snapshot cache.
+
+    Args:
+        file_path (str): Path to the OPT file.
+        cache_dir (str): Snapshot folder, defaults to __lgcache__ next to the file.
+
+    Returns:
+        OptSteps: Same content as read_opt, with read-only memory-mapped columns.
+    """
+    return _load("opt", file_path, cache_dir)
+
+
+def load_post(file_path, cache_dir=None):
+    """
+    Load a _post.lg file through the binary snapshot cache.
+
+    Args:
+        file_path (str): Path to the POST file.
+        cache_dir (str): Snapshot folder, defaults to __lgcache__ next to the file.
+
+    Returns:
+        PostSteps: Same content as read_post, with read-only memory-mapped columns.
+    """
+    return _load("post", file_path, cache_dir)
@@ -0,0 +1,335 @@
+import sys
+from array import array
+
+import numpy as np
+
+
+class Placement:
+    """
+    Columnar store of a parsed .lg file.
+
+    Cell i is described by names[i], x[i], y[i], w[i], h[i] and fixed[i].
+    Coordinates are NumPy int64 arrays and names are interned strings, so a
+    100k-cell design costs a few MB instead of one Python object per cell.
+    """
+    def __init__(self):
+        self.alpha = 0
+        self.beta = 0
+        self.die = (0, 0, 0, 0)  # lowerLeftX, lowerLeftY, upperRightX, upperRightY
+        self.names = []
+        self.name_index = {}
+        self.x = np.empty(0, dtype=np.int64)
+        self.y = np.empty(0, dtype=np.int64)
+        self.w = np.empty(0, dtype=np.int64)
+        self.h = np.empty(0, dtype=np.int64)
+        self.fixed = np.empty(0, dtype=np.bool_)
+        # one row per PlacementRows line: startX, startY, siteWidth, siteHeight, totalNumOfSites
+        self.rows = np.empty((0, 5), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"Placement(cells={len(self.names)}, rows={len(self.rows)}, die={self.die})"
+
+
+class OptSteps:
+    """
+    Columnar store of a parsed .opt file.
+
+    Step i banks remove_names[remove_offsets[i]:remove_offsets[i+1]] into
+    merge_names[i] suggested at (x[i], y[i]) with size (w[i], h[i]).
+    """
+    def __init__(self):
+        self.merge_names = []
+        self.x = np.empty(0, dtype=np.int64)
+        self.y = np.empty(0, dtype=np.int64)
+        self.w = np.empty(0, dtype=np.int64)
+        self.h = np.empty(0, dtype=np.int64)
+        self.remove_offsets = np.zeros(1, dtype=np.int64)
+        self.remove_names = []
+
+    def __len__(self):
+        return len(self.merge_names)
+
+    def removed(self, i):
+        return self.remove_names[self.remove_offsets[i]:self.remove_offsets[i + 1]]
+
+    def __repr__(self):
+        return f"OptSteps(steps={len(self.merge_names)}, removed={len(self.remove_names)})"
+
+
+class PostSteps:
+    """
+    Columnar store of a parsed _post.lg file.
+
+    Step i places its merged FF at (x[i], y[i]) and moves cells
+    move_names[j] to (move_x[j], move_y[j]) for j in
+    range(move_offsets[i], move_offsets[i+1]).
+    """
+    def __init__(self):
+        self.x = np.empty(0, dtype=np.int64)
+        self.y = np.empty(0, dtype=np.int64)
+        self.move_offsets = np.zeros(1, dtype=np.int64)
+        self.move_names = []
+        self.move_x = np.empty(0, dtype=np.int64)
+        self.move_y = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.x)
+
+    def moved(self, i):
+        begin, end = self.move_offsets[i], self.move_offsets[i + 1]
+        return self.move_names[begin:end], self.move_x[begin:end], self.move_y[begin:end]
+
+    def __repr__(self):
+        return f"PostSteps(steps={len(self.x)}, moved={len(self.move_names)})"
+
+
+class PostDelta:
+    """
+    One _post.lg step with its moved cells resolved to indices.
+
+    The merged FF is placed at (x, y) and cell moved_index[j] moves to
+    (moved_x[j], moved_y[j]). Names missing from the index get -1.
+    """
+    __slots__ = ("x", "y", "moved_index", "moved_x", "moved_y")
+
+    def __init__(self, x, y, moved_index, moved_x, moved_y):
+        self.x = x
+        self.y = y
+        self.moved_index = moved_index
+        self.moved_x = moved_x
+        self.moved_y = moved_y
+
+    def __len__(self):
+        return len(self.moved_index)
+
+    def __repr__(self):
+        return f"PostDelta(x={self.x}, y={self.y}, moved={len(self.moved_index)})"
+
+
+def _to_int64(values):
+    return np.frombuffer(values, dtype=np.int64).copy() if len(values) else np.empty(0, dtype=np.int64)
+
+
+def read_lg(file_path):
+    """
+    Stream an .lg file into a Placement.
+
+    Args:
+        file_path (str): Path to the LG file.
+
+    Returns:
+        Placement: Parsed parameters, die, cells and placement rows.
+    """
+    placement = Placement()
+    names = placement.names
+    name_index = placement.name_index
+    x, y, w, h = array('q'), array('q'), array('q'), array('q')
+    fixed = array('b')
+    rows = array('q')
+
+    with open(file_path, "r") as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith("#"):
+                continue
+            key = tokens[0]
+            if key == "Alpha":
+                placement.alpha = float(tokens[1])
+            elif key == "Beta":
+                placement.beta = float(tokens[1])
+            elif key == "DieSize":
+                placement.die = tuple(int(v) for v in tokens[1:5])
+            elif key == "PlacementRows":
+                rows.extend(int(v) for v in tokens[1:6])
+            elif len(tokens) == 6 and tokens[5] in ("FIX", "NOTFIX"):
+                name = sys.intern(key)
+                name_index[name] = len(names)
+                names.append(name)
+                x.append(int(tokens[1]))
+                y.append(int(tokens[2]))
+                w.append(int(tokens[3]))
+                h.append(int(tokens[4]))
+                fixed.append(tokens[5] == "FIX")
+
+    placement.x = _to_int64(x)
+    placement.y = _to_int64(y)
+    placement.w = _to_int64(w)
+    placement.h = _to_int64(h)
+    placement.fixed = np.frombuffer(fixed, dtype=np.int8).astype(np.bool_)
+    placement.rows = _to_int64(rows).reshape(-1, 5)
+    return placement
+
+
+def read_opt(file_path):
+    """
+    Stream an .opt file into OptSteps.
+
+    Args:
+        file_path (str): Path to the OPT file.
+
+    Returns:
+        OptSteps: Every Banking_Cell step in file order.
+    """
+    steps = OptSteps()
+    x, y, w, h = array('q'), array('q'), array('q'), array('q')
+    remove_offsets = array('q', [0])
+
+    with open(file_path, "r") as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0] != "Banking_Cell:":
+                continue
+            arrow = tokens.index("-->")
+            steps.remove_names.extend(sys.intern(name) for name in tokens[1:arrow])
+            remove_offsets.append(len(steps.remove_names))
+            steps.merge_names.append(sys.intern(tokens[arrow + 1]))
+            x.append(int(tokens[arrow + 2]))
+            y.append(int(tokens[arrow + 3]))
+            w.append(int(tokens[arrow + 4]))
+            h.append(int(tokens[arrow + 5]))
+
+    steps.x = _to_int64(x)
+    steps.y = _to_int64(y)
+    steps.w = _to_int64(w)
+    steps.h = _to_int64(h)
+    steps.remove_offsets = _to_int64(remove_offsets)
+    return steps
+
+
+def iter_post(file_path):
+    """
+    Stream a _post.lg file one step at a time.
+
+    Args:
+        file_path (str): Path to the POST file.
+
+    Yields:
+        tuple: (merge_x, merge_y, moved) where moved is a list of (name, x, y).
+    """
+    with open(file_path, "r") as f:
+        lines = (line for line in f if line.strip())
+        for line in lines:
+            merge_x, merge_y = line.split()
+            moved = []
+            # a truncated last step is yielded with the moved cells it has
+            for _ in range(int(next(lines, "0"))):
+                cell_line = next(lines, None)
+                if cell_line is None:
+                    break
+                name, x, y = cell_line.split()
+                moved.append((sys.intern(name), int(x), int(y)))
+            yield int(merge_x), int(merge_y), moved
+
+
+def iter_post_deltas(file_path, name_index):
+    """
+    Stream a _post.lg file as PostDelta records.
+
+    Names are looked up when each step is read, so the caller may add the
+    merged FF of step i to name_index before asking for step i + 1.
+
+    Args:
+        file_path (str): Path to the POST file.
+        name_index (dict): Cell name to index mapping.
+
+    Yields:
+        PostDelta: Merged FF position and moved cell indices of one step.
+    """
+    for merge_x, merge_y, moved in iter_post(file_path):
+        moved_index = np.fromiter((name_index.get(name, -1) for name, _, _ in moved), dtype=np.int64, count=len(moved))
+        moved_x = np.fromiter((x for _, x, _ in moved), dtype=np.int64, count=len(moved))
+        moved_y = np.fromiter((y for _, _, y in moved), dtype=np.int64, count=len(moved))
+        yield PostDelta(merge_x, merge_y, moved_index, moved_x, moved_y)
+
+
+def index_post(file_path):
+    """
+    Build a byte-offset index of a _post.lg file.
+
+    Args:
+        file_path (str): Path to the POST file.
+
+    Returns:
+        np.ndarray: int64 offset of the first line of every step, for read_post_at.
+    """
+    offsets = array('q')
+    with open(file_path, "rb") as f:
+        offset = 0
+        expect = "position"
+        remaining = 0
+        for line in f:
+            start = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            if expect == "position":
+                offsets.append(start)
+                expect = "count"
+            elif expect == "count":
+                remaining = int(line)
+                expect = "cell" if remaining > 0 else "position"
+            else:
+                remaining -= 1
+                if remaining == 0:
+                    expect = "position"
+    return _to_int64(offsets)
+
+
+def read_post_at(f, offset):
+    """
+    Read one _post.lg step at a byte offset from index_post.
+
+    Args:
+        f: POST file opened in binary mode.
+        offset (int): Byte offset of the step.
+
+    Returns:
+        tuple: (merge_x, merge_y, moved) where moved is a list of (name, x, y).
+    """
+    f.seek(offset)
+    lines = (line for line in f if line.strip())
+    merge_x, merge_y = next(lines).split()
+    moved = []
+    # a truncated last step returns the moved cells it has, like iter_post
+    for _ in range(int(next(lines, b"0"))):
+        cell_line = next(lines, None)
+        if cell_line is None:
+            break
+        name, x, y = cell_line.split()
+        moved.append((sys.intern(name.decode()), int(x), int(y)))
+    return int(merge_x), int(merge_y), moved
+
+
+def read_post(file_path):
+    """
+    Stream a _post.lg file into PostSteps.
+
+    Args:
+        file_path (str): Path to the POST file.
+
+    Returns:
+        PostSteps: Legalized merged FF position and moved cells of every step.
+    """
+    steps = PostSteps()
+    x, y = array('q'), array('q')
+    move_offsets = array('q', [0])
+    move_x, move_y = array('q'), array('q')
+
+    for merge_x, merge_y, moved in iter_post(file_path):
+        x.append(merge_x)
+        y.append(merge_y)
+        for name, cell_x, cell_y in moved:
+            steps.move_names.append(name)
+            move_x.append(cell_x)
+            move_y.append(cell_y)
+        move_offsets.append(len(steps.move_names))
+
+    steps.x = _to_int64(x)
+    steps.y = _to_int64(y)
+    steps.move_offsets = _to_int64(move_offsets)
+    steps.move_x = _to_int64(move_x)
+    steps.move_y = _to_int64(move_y)
+    return steps
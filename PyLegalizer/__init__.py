@@ -0,0 +1,9 @@
+from .rows import FreeRows, RowCells
+from .bands import BandIndex
+from .abacus import shift_row, push_costs, solve_window
+from .legalizer import Legalizer, LegalizeError, StepResult, SHIFT_REACH, EVALUATE_ROWS, write_post_step
+
+__all__ = [
+    "FreeRows", "RowCells", "BandIndex", "shift_row", "push_costs", "solve_window",
+    "Legalizer", "LegalizeError", "StepResult", "SHIFT_REACH", "EVALUATE_ROWS", "write_post_step",
+]
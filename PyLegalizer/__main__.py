@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from LgParser import load_lg, load_opt
+from PyLegalizer import Legalizer, LegalizeError, SHIFT_REACH, write_post_step
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m PyLegalizer",
+                                     description="Reference local legalizer: ./Legalizer *.lg *.opt *_post.lg")
+    parser.add_argument("lg", help="Legalized placement (.lg)")
+    parser.add_argument("opt", help="Optimizer steps (.opt)")
+    parser.add_argument("post", help="Output file (_post.lg)")
+    parser.add_argument("--shift-reach", type=int, default=SHIFT_REACH,
+                        help="How far NOTFIX cells may be pushed aside to make room for a merged FF, 0 never moves them.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    placement = load_lg(args.lg)
+    opt_steps = load_opt(args.opt)
+    legalizer = Legalizer(placement, shift_reach=args.shift_reach)
+    load_time = time.perf_counter() - start
+    print(f"Loaded {len(placement)} cells, {len(opt_steps)} steps in {load_time:.2f} s")
+
+    start = time.perf_counter()
+    steps = 0
+    try:
+        with open(args.post, "w") as f:
+            for merge_x, merge_y, moved in legalizer.run(opt_steps):
+                write_post_step(f, merge_x, merge_y, moved)
+                steps += 1
+    except LegalizeError as e:
+        print(f"Error: step {steps + 1}: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    print(f"Legalized {steps} steps in {elapsed:.2f} s ({steps / max(elapsed, 1e-9):.1f} steps/sec)")
+
+
+if __name__ == "__main__":
+    main()
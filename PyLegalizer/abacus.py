@@ -0,0 +1,272 @@
+import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def shift_row(x, w, start, split, width):
+    """
+    Push the cells of one row window aside for a cell inserted at start.
+
+    Abacus-style cluster collapse (Spindler et al., ISPD'08) for a single inserted
+    cell: cells keep their order, cells [0, split) form a cluster abutting it from
+    the left, the others one abutting it from the right, and a cell only moves if
+    its cluster reaches it. For a fixed start and split no placement moves fewer
+    cells or moves them less.
+
+    Args:
+        x, w (np.ndarray): Lower-left x and widths of the NOTFIX cells of the window, sorted and not overlapping.
+        start (int): Lower-left x of the inserted cell.
+        split (int): Number of cells left of the inserted cell.
+        width (int): Width of the inserted cell.
+
+    Returns:
+        np.ndarray: New lower-left x of the cells.
+    """
+    prefix, u = _squeeze(x, w)
+    # with the widths squeezed out both clusters are just points at start - prefix[split]
+    t = start - prefix[split]
+    return np.where(np.arange(len(x)) < split, np.minimum(u, t), np.maximum(u, t + width)) + prefix[:-1]
+
+
+def _squeeze(x, w):
+    """Prefix widths and u = x - prefix, sorted since the cells don't overlap."""
+    prefix = np.concatenate(([0], np.cumsum(w)))
+    return prefix, x - prefix[:-1]
+
+
+def _push_costs(prefix, u, lo, hi, starts, width, alpha, beta):
+    t = starts[:, None] - prefix[None, :]
+    # the clusters fit iff the squeezed point fits between lo and hi less all widths
+    fits = (t >= lo) & (t + width + prefix[-1] <= hi)
+    if len(u) == 0:
+        return np.where(fits, 0.0, np.inf)
+    splits = np.arange(len(prefix))
+    sum_u = np.concatenate(([0], np.cumsum(u)))
+    # left cells [first_left, split) and right cells [split, last_right) move
+    first_left = np.minimum(np.searchsorted(u, t, side="right"), splits)
+    last_right = np.maximum(np.searchsorted(u, t + width, side="left"), splits)
+    num_left = splits - first_left
+    num_right = last_right - splits
+    distance = (sum_u[splits] - sum_u[first_left] - t * num_left
+                + (t + width) * num_right - (sum_u[last_right] - sum_u[splits]))
+    cost = alpha * (num_left + num_right) + beta * distance.astype(np.float64)
+    return np.where(fits, cost, np.inf)
+
+
+def push_costs(x, w, lo, hi, starts, width, alpha, beta):
+    """
+    Cost of shift_row for every start and split, alpha per pushed cell plus beta per unit pushed.
+
+    Squeezing the widths out (u = x - prefix width) turns both clusters into a
+    point at t = start - prefix[split]: left cells with u > t and right cells
+    with u < t + width move by the difference. u is sorted, so each cost is
+    two bisects and prefix sums, O(log len(x)).
+
+    Returns:
+        np.ndarray: len(starts) x (len(x) + 1) costs, inf where the clusters don't fit in [lo, hi).
+    """
+    prefix, u = _squeeze(x, w)
+    return _push_costs(prefix, u, lo, hi, np.asarray(starts), width, alpha, beta)
+
+
+def _row(cell_x, cell_w, lo, hi):
+    """Sorted lists of one window for the sweeps: x, right ends, prefix widths, u and prefix sums of u."""
+    x, ends, prefix = cell_x.tolist(), (cell_x + cell_w).tolist(), [0]
+    for cell_width in cell_w.tolist():
+        prefix.append(prefix[-1] + cell_width)
+    u, sums = [], [0]
+    for left, width in zip(x, prefix):
+        u.append(left - width)
+        sums.append(sums[-1] + left - width)
+    return x, ends, prefix, u, sums, lo, hi
+
+
+def _best_split(row, start, width, alpha, beta):
+    """
+    Cheapest split of one window for the cell at start, (cost, split), or (inf, None) if none fits.
+
+    Cells entirely left (right) of the inserted cell stay on its left (right):
+    moving one to the other side can only push more cells further. Only the
+    cells it overlaps are tried on either side, from all of them on the right
+    to all on the left. The squeezed point t = start - prefix[split] only falls
+    as the split grows, so the first left cell and the last right cell that
+    move are two pointers that only walk down, O(n) for the whole sweep.
+    """
+    x, ends, prefix, u, sums, lo, hi = row
+    first = bisect_right(ends, start)
+    last = bisect_left(x, start + width)
+    total = prefix[-1]
+    t = start - prefix[first]
+    # left cells [left, split) and right cells [split, right) move
+    left = bisect_right(u, t)
+    right = bisect_left(u, t + width)
+    best, best_split = math.inf, None
+    for split in range(first, last + 1):
+        t = start - prefix[split]
+        if t < lo:
+            # the left cluster runs into the window edge, more left cells only make it longer
+            break
+        while left and u[left - 1] > t:
+            left -= 1
+        while right and u[right - 1] >= t + width:
+            right -= 1
+        if t + width + total > hi:
+            continue
+        num_left = split - left if left < split else 0
+        num_right = right - split if right > split else 0
+        distance = (sums[split] - sums[split - num_left] - t * num_left
+                    + (t + width) * num_right - (sums[split + num_right] - sums[split]))
+        cost = alpha * (num_left + num_right) + beta * distance
+        if cost < best:
+            best, best_split = cost, split
+    return best, best_split
+
+
+def _starts(row, width):
+    """
+    Starts where the cost of one window can bend or jump.
+
+    A split is only ever the best one while the inserted cell overlaps the
+    cells on both sides of it (see _best_split), and within that span its cost
+    breaks where a left cell starts moving (t = u), a right cell starts moving
+    (t = u - width) or a cluster hits a window edge. The u in the span are a
+    contiguous run of the sorted u, found by bisection.
+    """
+    x, ends, prefix, u, _, lo, hi = row
+    n = len(x)
+    edges = (lo, hi - width - prefix[-1])
+    starts = set()
+    for split in range(n + 1):
+        packed = prefix[split]
+        t_low = x[split - 1] - width - packed if split else -math.inf
+        t_high = ends[split] - packed if split < n else math.inf
+        starts.update(t + packed for t in u[bisect_left(u, t_low, 0, split):bisect_right(u, t_high, 0, split)])
+        starts.update(t - width + packed
+                      for t in u[bisect_left(u, t_low + width, split):bisect_right(u, t_high + width, split)])
+        starts.update(t + packed for t in edges if t_low <= t <= t_high)
+    return starts
+
+
+def solve_window(windows, x, width, alpha, beta, bound=math.inf):
+    """
+    Cheapest insertion of a width wide cell wanted at x into a stack of row windows.
+
+    The cell covers one row window per row of its height and every row picks
+    its own split. Cost is the .lg cost: beta times the distance the inserted
+    cell is off x, plus alpha and beta times the distance for every cell pushed.
+    For a given start every row is one Abacus sweep over its splits
+    (_best_split), O(n) for n cells per window. For fixed splits the cost is
+    piecewise linear in the start and only jumps up away from its breakpoints,
+    so the minimum is at x or at a breakpoint of a split that is live there
+    (_starts). A split is live under O(1) cells, so every row adds O(n) starts
+    for a cell not much wider than the cells it pushes. They are tried nearest
+    to x first and the search stops once the cell's own displacement costs more
+    than the best found.
+
+    Args:
+        windows (list): (x, w, lo, hi) of each row, as for push_costs.
+        x (int): Wanted lower-left x.
+        width (int): Width of the inserted cell.
+        alpha, beta (float): Cost weights from the .lg.
+        bound (float): Only look for insertions costing less.
+
+    Returns:
+        tuple: (cost, start, new_x) with new_x the new positions of every window's
+            cells, or None if the cell fits nowhere (for less than bound).
+    """
+    # the cell itself must fit in every window
+    lowest = max(lo for _, _, lo, _ in windows)
+    highest = min(hi for _, _, _, hi in windows) - width
+    if lowest > highest:
+        return None
+    # rows without cells cost nothing wherever the cell fits
+    crowded = [(k, _row(cell_x, cell_w, lo, hi))
+               for k, (cell_x, cell_w, lo, hi) in enumerate(windows) if len(cell_x)]
+    shifted = [cell_x for cell_x, _, _, _ in windows]
+    if not crowded:
+        start = min(max(x, lowest), highest)
+        cost = beta * abs(start - x)
+        return (float(cost), start, shifted) if cost < bound else None
+    starts = {x, lowest, highest}
+    for _, row in crowded:
+        starts.update(_starts(row, width))
+    rows = [row for _, row in crowded]
+    best, best_start, best_splits = bound, math.inf, None
+    # nearest starts first, once the cell's own displacement costs more than the best nothing further can win
+    for start in sorted(starts, key=lambda start: abs(start - x)):
+        cost = beta * abs(start - x)
+        if cost > best:
+            break
+        if not lowest <= start <= highest:
+            continue
+        splits = []
+        for row in rows:
+            row_cost, split = _best_split(row, start, width, alpha, beta)
+            cost += row_cost
+            if cost > best:
+                break
+            splits.append(split)
+        else:
+            # of equally cheap starts the leftmost wins
+            if cost < best or (best_splits is not None and start < best_start):
+                best, best_start, best_splits = cost, start, splits
+    if best_splits is None:
+        return None
+    for (k, _), split in zip(crowded, best_splits):
+        cell_x, cell_w, _, _ = windows[k]
+        shifted[k] = shift_row(cell_x, cell_w, best_start, split, width)
+    return float(best), best_start, shifted
+
+
+def _brute_force(windows, x, width, alpha, beta):
+    """Cheapest cost of solve_window by trying every integer start and split with shift_row."""
+    best = math.inf
+    for start in range(max(lo for _, _, lo, _ in windows), min(hi for _, _, _, hi in windows) - width + 1):
+        cost = beta * abs(start - x)
+        for cell_x, cell_w, lo, hi in windows:
+            row_best = math.inf
+            for split in range(len(cell_x) + 1):
+                new_x = shift_row(cell_x, cell_w, start, split, width)
+                if len(cell_x) and (new_x[0] < lo or new_x[-1] + cell_w[-1] > hi):
+                    continue
+                row_best = min(row_best, alpha * np.count_nonzero(new_x != cell_x) + beta * np.abs(new_x - cell_x).sum())
+            cost += row_best
+        best = min(best, cost)
+    return best
+
+
+def _self_test(trials=500, seed=0):
+    """Compare solve_window with _brute_force on random stacks of small windows: python PyLegalizer/abacus.py"""
+    rng = np.random.default_rng(seed)
+    for _ in range(trials):
+        width = int(rng.integers(1, 13))
+        windows = []
+        for _ in range(rng.integers(1, 5)):
+            lo, hi = int(rng.integers(0, 5)), int(rng.integers(45, 61))
+            cell_w = rng.integers(1, 9, rng.integers(0, 8))
+            cell_x = lo + rng.integers(0, 6) + np.concatenate(([0], np.cumsum(cell_w + rng.integers(0, 7, len(cell_w)))[:-1]))
+            fits = cell_x + cell_w <= hi
+            windows.append((cell_x[fits], cell_w[fits], lo, hi))
+        x = int(rng.integers(0, 51 - width))
+        alpha, beta = float(rng.choice([0, 0.5, 3, 20])), int(rng.integers(1, 3))
+        expected = _brute_force(windows, x, width, alpha, beta)
+        solution = solve_window(windows, x, width, alpha, beta)
+        if solution is None:
+            assert expected == math.inf, (windows, x, width, alpha, beta)
+            continue
+        cost, start, shifted = solution
+        assert abs(cost - expected) < 1e-9, (windows, x, width, alpha, beta, cost, expected)
+        # the returned placement is legal and costs what solve_window says
+        total = beta * abs(start - x)
+        for (cell_x, cell_w, lo, hi), new_x in zip(windows, shifted):
+            spans = sorted(list(zip(new_x.tolist(), (new_x + cell_w).tolist())) + [(start, start + width)])
+            assert spans[0][0] >= lo and spans[-1][1] <= hi
+            assert all(end <= next_start for (_, end), (next_start, _) in zip(spans, spans[1:]))
+            total += alpha * np.count_nonzero(new_x != cell_x) + beta * np.abs(new_x - cell_x).sum()
+        assert abs(total - cost) < 1e-9
+    print(f"solve_window matches brute force on {trials} random windows")
+
+
+if __name__ == "__main__":
+    _self_test()
@@ -0,0 +1,210 @@
+import heapq
+import math
+from bisect import bisect_right
+
+import numpy as np
+
+# consecutive bands whose slot ranges are merged into one |dx| bound in nearest
+GROUP_BANDS = 16
+
+
+class BandIndex:
+    """
+    Free windows of stacked placement rows, for cells one or more rows high.
+
+    The band (r, k) is the k consecutive rows starting at row r, and its windows
+    are the maximal x-intervals free in all k rows. They come from one merged
+    sweep over the k row interval lists of a FreeRows and are cached as NumPy
+    arrays until one of those rows changes. Every cell width reuses that sweep:
+    the windows wide enough are reduced to sorted ranges of legal lower-left x,
+    kept with the sweep, so a query costs one bisect per band it visits and
+    never looks at single sites. The ranges of GROUP_BANDS consecutive bands
+    are also merged per width, which bounds |dx| for the whole group in one
+    bisect and lets nearest skip groups whose slots are all too far in x.
+    """
+    def __init__(self, free_rows):
+        self.free = free_rows
+        # every cache keeps the entries of the last two states of its rows, so rolling
+        # back a tentative step (Legalizer.rollback) finds the ones from before it
+        self._rows = [()] * free_rows.num_rows  # r -> ((row version, interval starts, interval ends), ...)
+        # k -> r -> ((row versions, window starts, window ends, {w: (lowest x list, highest x list)}), ...)
+        self._windows = {}
+        # (k, w) -> group -> ((row versions, lows of all its bands sorted, running max of their highs), ...)
+        self._groups = {}
+
+    @staticmethod
+    def _lookup(cache, key, versions, build):
+        entries = cache[key]
+        for entry in entries:
+            if entry[0] == versions:
+                return entry
+        entry = (versions, *build())
+        cache[key] = (entry,) + entries[:1]
+        return entry
+
+    def row_intervals(self, r):
+        """Free intervals of row r as (starts, ends) int64 arrays."""
+        free = self.free
+        entry = self._lookup(self._rows, r, free.versions[r],
+                             lambda: (np.array(free.starts[r], dtype=np.int64), np.array(free.ends[r], dtype=np.int64)))
+        return entry[1], entry[2]
+
+    def _bands(self, k):
+        cache = self._windows.get(k)
+        if cache is None:
+            cache = self._windows[k] = [()] * self.free.num_rows
+        return cache
+
+    def _band(self, r, k):
+        return self._lookup(self._bands(k), r, self.free.versions[r:r + k], lambda: (*self._sweep(r, k), {}))
+
+    def windows(self, r, k):
+        """
+        Free windows of the k rows starting at row r.
+
+        Returns:
+            tuple: (starts, ends) int64 arrays of half-open windows sorted by x.
+        """
+        entry = self._band(r, k)
+        return entry[1], entry[2]
+
+    def slot_ranges(self, r, k, w):
+        """
+        Legal lower-left x of a w wide cell in the k rows starting at row r.
+
+        Returns:
+            tuple: (lows, highs) sorted lists, x is legal iff lows[i] <= x <= highs[i] for some i.
+        """
+        return self._ranges(self._band(r, k), w)
+
+    @staticmethod
+    def _ranges(entry, w):
+        _, starts, ends, ranges = entry
+        result = ranges.get(w)
+        if result is None:
+            wide = ends - starts >= w
+            result = ranges[w] = (starts[wide].tolist(), (ends[wide] - w).tolist())
+        return result
+
+    def _group_gap(self, g, k, w, x):
+        """Lower bound of |dx| from x to the w wide slots of the bands of group g."""
+        cache = self._groups.get((k, w))
+        if cache is None:
+            cache = self._groups[k, w] = [()] * (self.free.num_rows // GROUP_BANDS + 1)
+        first = g * GROUP_BANDS
+        _, lows, reach = self._lookup(cache, g, self.free.versions[first:first + GROUP_BANDS + k - 1],
+                                      lambda: self._merge_group(first, k, w))
+        i = bisect_right(lows, x)
+        gap = lows[i] - x if i < len(lows) else math.inf
+        if i:
+            # reach[i - 1] is the highest slot x of every range starting left of x
+            gap = min(gap, max(x - reach[i - 1], 0))
+        return gap
+
+    def _merge_group(self, first, k, w):
+        bands = [self._band(r, k) for r in range(first, min(first + GROUP_BANDS, self.free.num_rows - k + 1))]
+        starts = np.concatenate([entry[1] for entry in bands])
+        ends = np.concatenate([entry[2] for entry in bands])
+        wide = ends - starts >= w
+        starts, ends = starts[wide], ends[wide]
+        order = np.argsort(starts, kind="stable")
+        return starts[order].tolist(), np.maximum.accumulate(ends[order] - w).tolist()
+
+    def _sweep(self, r, k):
+        if k == 1:
+            return self.row_intervals(r)
+        rows = [self.row_intervals(i) for i in range(r, r + k)]
+        starts = np.concatenate([row[0] for row in rows])
+        ends = np.concatenate([row[1] for row in rows])
+        # events sorted by x, ends before starts at the same x: +1 at every interval start,
+        # -1 at every end, and x is free in all k rows where the depth reaches k
+        events = np.concatenate((ends * 2, starts * 2 + 1))
+        events.sort()
+        depth = np.cumsum((events & 1) * 2 - 1)
+        # intervals of one row never touch, so depth-k runs are already maximal
+        full = np.flatnonzero(depth[:-1] == k)
+        return events[full] >> 1, events[full + 1] >> 1
+
+    def nearest(self, x, y, w, h, count=1, max_displacement=None):
+        """
+        The count nearest legal lower-left corners for a w x h cell wanted at (x, y).
+
+        Each free window wide enough for the cell contributes one candidate, its
+        position closest to x. Bands are visited by increasing |dy| and the search
+        stops once |dy| alone can't beat the count-th best displacement, or exceeds
+        max_displacement, which keeps "is there a slot close by" queries cheap.
+        Groups of GROUP_BANDS bands whose merged ranges are all too far in x are
+        skipped as a whole.
+
+        Args:
+            x, y (int): Wanted lower-left corner.
+            w, h (int): Cell size, h is rounded up to whole rows.
+            count (int): Number of positions to return.
+            max_displacement (int): Only return positions at most this far, None for no limit.
+
+        Returns:
+            list: Up to count (displacement, x, y) tuples, nearest first.
+        """
+        free = self.free
+        k = free.rows_for_height(h)
+        last = free.num_rows - k
+        if last < 0 or count < 1:
+            return []
+        y0, row_height, versions, bands = free.y0, free.row_height, free.versions, self._bands(k)
+        r0 = min(max((y - y0) // row_height, 0), last)
+        # max-heap of the best candidates so far as (-displacement, -x, -y), worst its displacement once full
+        best = []
+        worst = math.inf
+        limit = max_displacement if max_displacement is not None else math.inf
+        up, down = r0, r0 - 1
+        # last group bounded going up and going down
+        up_group = down_group = -1
+        while up <= last or down >= 0:
+            # next band by distance from y
+            going_up = down < 0 or (up <= last and y0 + up * row_height - y <= y - y0 - down * row_height)
+            if going_up:
+                r = up
+                up += 1
+            else:
+                r = down
+                down -= 1
+            row_y = y0 + r * row_height
+            dy = row_y - y if row_y >= y else y - row_y
+            if dy > limit or dy >= worst:
+                # bands come in order of |dy|, none of the remaining ones can do better
+                break
+            g = r // GROUP_BANDS
+            if (worst < math.inf or limit < math.inf) and g != (up_group if going_up else down_group):
+                # this band is the nearest of the rest of its group in this direction
+                if going_up:
+                    up_group = g
+                else:
+                    down_group = g
+                bound = dy + self._group_gap(g, k, w, x)
+                if bound > limit or bound >= worst:
+                    if going_up:
+                        up = (g + 1) * GROUP_BANDS
+                    else:
+                        down = g * GROUP_BANDS - 1
+                    continue
+            # inlined cache hit of slot_ranges, this loop runs for every band visited
+            entries = bands[r]
+            entry = entries[0] if entries and entries[0][0] == versions[r:r + k] else self._band(r, k)
+            ranges = entry[3].get(w)
+            lows, highs = ranges if ranges is not None else self._ranges(entry, w)
+            # ranges are disjoint and sorted, the count nearest ones are around the bisect point
+            i = bisect_right(lows, x)
+            for j in range(i - count if i > count else 0, min(i + count, len(lows))):
+                low, high = lows[j], highs[j]
+                slot_x = x if low <= x <= high else (low if low > x else high)
+                cost = (slot_x - x if slot_x >= x else x - slot_x) + dy
+                if cost > limit:
+                    continue
+                if len(best) < count:
+                    heapq.heappush(best, (-cost, -slot_x, -row_y))
+                    if len(best) == count:
+                        worst = -best[0][0]
+                elif cost < worst:
+                    heapq.heapreplace(best, (-cost, -slot_x, -row_y))
+                    worst = -best[0][0]
+        return sorted((-c, -sx, -sy) for c, sx, sy in best)
@@ -0,0 +1,350 @@
+import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from .abacus import solve_window
+from .bands import BandIndex
+from .rows import FreeRows, RowCells
+
+# how far beyond the merged FF the row windows reach for NOTFIX cells to push aside
+SHIFT_REACH = 40000
+# bands (nearest by |dy|) in which pushing NOTFIX cells aside is tried
+SHIFT_BANDS = 3
+# rows of displacement within which evaluate looks for a position unless given a max_cost
+EVALUATE_ROWS = 20
+
+
+class LegalizeError(RuntimeError):
+    """Raised when a merged FF fits nowhere in the placement."""
+
+
+class StepResult:
+    """
+    Outcome of one Banking_Cell step.
+
+    The merged FF goes to (x, y) and moved lists the other cells it displaced as
+    (name, x, y). cost is alpha * len(moved) + beta * displacement, where
+    displacement adds the merged FF's distance from its .opt position to the
+    distances the moved cells travel.
+    """
+    __slots__ = ("x", "y", "moved", "cost")
+
+    def __init__(self, x, y, moved, cost):
+        self.x = x
+        self.y = y
+        self.moved = moved
+        self.cost = cost
+
+    def __repr__(self):
+        return f"StepResult(x={self.x}, y={self.y}, moved={len(self.moved)}, cost={self.cost:g})"
+
+
+class Legalizer:
+    """
+    Local legalizer replaying .opt banking steps on a legalized placement.
+
+    Cell state is kept in flat lists indexed like Placement (merged FFs are
+    appended), the free space in a FreeRows index and the multi-row windows in
+    a BandIndex on top of it. Every step frees the banked FFs and puts the
+    merged FF on the nearest free slot of its size, or at its .opt x in one of
+    the nearest bands with the NOTFIX cells in the way pushed aside along their
+    rows (solve_window), whichever costs less.
+
+    A step can also be applied tentatively with try_step and then kept with
+    commit or undone with rollback. While it is pending every change appends
+    an undo record (the old slice of a changed row, a flag, a position) to a
+    journal, so rolling back never copies the placement. Transactions nest:
+    inside begin() the steps committed join the enclosing transaction and can
+    still be undone back to a savepoint(), so a sequence of steps can be tried
+    and dropped together.
+    """
+    def __init__(self, placement, shift_reach=SHIFT_REACH):
+        self.alpha = placement.alpha
+        self.beta = placement.beta
+        self.names = list(placement.names)
+        self.name_index = dict(placement.name_index)
+        self.x = placement.x.tolist()
+        self.y = placement.y.tolist()
+        self.w = placement.w.tolist()
+        self.h = placement.h.tolist()
+        self.fixed = placement.fixed.tolist()
+        self.alive = [True] * len(self.names)
+        self.free = FreeRows.from_placement(placement)
+        self.bands = BandIndex(self.free)
+        self.row_cells = RowCells.from_placement(placement, self.free)
+        # 0 never pushes cells and only looks for free slots
+        self.shift_reach = shift_reach
+        # undo records (function, *args) of the innermost open transaction, None when there is none
+        self.journal = None
+        # journals of the enclosing transactions
+        self._outer = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def remove(self, name):
+        """Remove a banked FF and free its space, returns its index."""
+        i = self.name_index[name]
+        if not self.alive[i]:
+            raise KeyError(name)
+        if self.journal is not None:
+            self.journal.append((self.alive.__setitem__, i, True))
+        self.alive[i] = False
+        self.free.release(self.x[i], self.y[i], self.w[i], self.h[i])
+        self.row_cells.discard(i, self.x[i], self.y[i], self.h[i])
+        return i
+
+    def insert(self, name, x, y, w, h):
+        """Add a NOTFIX cell at a free position, returns its index."""
+        i = len(self.names)
+        self.names.append(name)
+        self.name_index[name] = i
+        self.x.append(x)
+        self.y.append(y)
+        self.w.append(w)
+        self.h.append(h)
+        self.fixed.append(False)
+        self.alive.append(True)
+        if self.journal is not None:
+            self.journal.append((self._pop_cell,))
+        self.free.occupy(x, y, w, h)
+        self.row_cells.add(i, x, y, h)
+        return i
+
+    def move_cells(self, moved):
+        """Move NOTFIX cells together, moved is a list of (name, x, y) and the new positions must be free once all of them left."""
+        cells = [(self.name_index[name], x, y) for name, x, y in moved]
+        for i, _, _ in cells:
+            self.free.release(self.x[i], self.y[i], self.w[i], self.h[i])
+            self.row_cells.discard(i, self.x[i], self.y[i], self.h[i])
+        for i, x, y in cells:
+            if self.journal is not None:
+                self.journal.append((self._place, i, self.x[i], self.y[i]))
+            self.x[i] = x
+            self.y[i] = y
+            self.free.occupy(x, y, self.w[i], self.h[i])
+            self.row_cells.add(i, x, y, self.h[i])
+
+    def _place(self, i, x, y):
+        self.x[i] = x
+        self.y[i] = y
+
+    def _pop_cell(self):
+        del self.name_index[self.names.pop()]
+        for column in (self.x, self.y, self.w, self.h, self.fixed, self.alive):
+            column.pop()
+
+    def begin(self):
+        """Open a transaction, closed by commit() or rollback(). Transactions nest."""
+        self._outer.append(self.journal)
+        self.journal = self.free.journal = self.row_cells.journal = []
+
+    def savepoint(self):
+        """Mark the current state of the open transaction for rollback(savepoint)."""
+        return len(self.journal)
+
+    def try_step(self, merge_name, removed, x, y, w, h, max_cost=None):
+        """
+        Apply one Banking_Cell step tentatively, follow it with commit() or rollback().
+
+        Args:
+            merge_name (str): Name of the merged FF.
+            removed (list): Names of the banked FFs.
+            x, y, w, h (int): Suggested position and size of the merged FF.
+            max_cost (float): Give up on legalizations costing more, None for no limit.
+
+        Returns:
+            StepResult: Legalized position, moved cells and cost of the step.
+
+        Raises:
+            LegalizeError: No legal position (within max_cost), nothing is left applied.
+        """
+        # the merged FF's displacement alone costs beta per unit, which bounds the search
+        limit = int(max_cost // self.beta) if max_cost is not None and max_cost < math.inf and self.beta > 0 else None
+        result = self.try_step_within(merge_name, removed, x, y, w, h, limit)
+        if max_cost is not None and result.cost > max_cost:
+            self.rollback()
+            raise LegalizeError(f"No legal position for {merge_name} ({w} x {h}) within cost {max_cost:g}")
+        return result
+
+    def try_step_within(self, merge_name, removed, x, y, w, h, max_displacement=None):
+        """try_step bounded by the displacement of the merged FF instead of the cost."""
+        self.begin()
+        try:
+            for name in removed:
+                self.remove(name)
+            slots = self.bands.nearest(x, y, w, h, max_displacement=max_displacement)
+            best = None
+            if slots:
+                displacement, slot_x, slot_y = slots[0]
+                best = (self.beta * displacement, slot_x, slot_y, [])
+            shift = self._best_shift(x, y, w, h, best[0] if best else math.inf, max_displacement)
+            if shift is not None:
+                best = shift
+            if best is None:
+                raise LegalizeError(f"No legal position for {merge_name} ({w} x {h})")
+            cost, merge_x, merge_y, moved = best
+            self.move_cells(moved)
+            self.insert(merge_name, merge_x, merge_y, w, h)
+        except BaseException:
+            self.rollback()
+            raise
+        return StepResult(merge_x, merge_y, moved, cost)
+
+    def _best_shift(self, x, y, w, h, bound, max_displacement):
+        """
+        Cheapest placement pushing NOTFIX cells aside, in the SHIFT_BANDS bands nearest to y.
+
+        Returns:
+            tuple: (cost, x, y, moved) costing less than bound, or None.
+        """
+        free = self.free
+        k = free.rows_for_height(h)
+        last = free.num_rows - k
+        if self.shift_reach <= 0 or last < 0:
+            return None
+        limit = max_displacement if max_displacement is not None else math.inf
+        r0 = min(max((y - free.y0) // free.row_height, 0), last)
+        best = None
+        up, down = r0, r0 - 1
+        for _ in range(SHIFT_BANDS):
+            # same band order as BandIndex.nearest
+            if down < 0 or (up <= last and abs(free.row_y(up) - y) <= abs(free.row_y(down) - y)):
+                if up > last:
+                    break
+                r = up
+                up += 1
+            else:
+                r = down
+                down -= 1
+            row_y = free.row_y(r)
+            dy = abs(row_y - y)
+            if dy > limit or self.beta * dy >= bound:
+                break
+            windows = [self._row_window(q, x, x + w) for q in range(r, r + k)]
+            if None in windows:
+                continue
+            solution = solve_window([window[:4] for window in windows], x, w, self.alpha, self.beta,
+                                    bound - self.beta * dy)
+            if solution is None:
+                continue
+            cost, start, shifted = solution
+            moved = []
+            for (cell_x, _, _, _, cells), new_x in zip(windows, shifted):
+                for i, old, new in zip(cells, cell_x.tolist(), new_x.tolist()):
+                    if new != old:
+                        moved.append((self.names[i], new, self.y[i]))
+            bound = cost + self.beta * dy
+            best = (bound, start, row_y, moved)
+        return best
+
+    def _row_window(self, r, a, b):
+        """
+        Stretch of row r around [a, b) holding only free space and single-row NOTFIX cells.
+
+        It ends at the first other cell, the end of the placement row segment, or
+        shift_reach beyond [a, b), where a cell crossing that limit ends it too.
+
+        Returns:
+            tuple: (x, w, lo, hi, cells) with the NOTFIX cells' positions and widths as
+                int64 arrays and their indices, or None if a isn't on a row segment.
+        """
+        free = self.free
+        row_starts, row_ends = free.row_starts[r], free.row_ends[r]
+        segment = bisect_right(row_ends, a)
+        if segment == len(row_starts) or row_starts[segment] > a:
+            return None
+        lo = max(row_starts[segment], a - self.shift_reach)
+        hi = min(row_ends[segment], b + self.shift_reach)
+        row_y = free.row_y(r)
+        xs, cells = self.row_cells.xs[r], self.row_cells.cells[r]
+        left, right = [], []
+        j = bisect_left(xs, a)
+        for i in reversed(cells[:j]):
+            end = self.x[i] + self.w[i]
+            if end <= lo:
+                break
+            if self.fixed[i] or self.y[i] != row_y or self.h[i] > free.row_height or self.x[i] < lo:
+                lo = end
+                break
+            left.append(i)
+        for i in cells[j:]:
+            if self.x[i] >= hi:
+                break
+            if self.fixed[i] or self.y[i] != row_y or self.h[i] > free.row_height or self.x[i] + self.w[i] > hi:
+                hi = self.x[i]
+                break
+            right.append(i)
+        window = left[::-1] + right
+        cell_x = np.array([self.x[i] for i in window], dtype=np.int64)
+        cell_w = np.array([self.w[i] for i in window], dtype=np.int64)
+        return cell_x, cell_w, lo, hi, window
+
+    def commit(self):
+        """Keep the changes of the innermost transaction, they join the enclosing one if any."""
+        journal = self.journal
+        self.journal = self.free.journal = self.row_cells.journal = self._outer.pop()
+        if self.journal is not None:
+            self.journal.extend(journal)
+
+    def rollback(self, savepoint=None):
+        """
+        Undo the innermost transaction and close it.
+
+        Args:
+            savepoint (int): Only undo the changes made after this savepoint() and keep the transaction open.
+        """
+        journal = self.journal
+        if savepoint is None:
+            self.journal = self.free.journal = self.row_cells.journal = self._outer.pop()
+            savepoint = 0
+        for k in range(len(journal) - 1, savepoint - 1, -1):
+            undo, *args = journal[k]
+            undo(*args)
+        del journal[savepoint:]
+
+    def evaluate(self, merge_name, removed, x, y, w, h, max_cost=None):
+        """
+        What-if query: the StepResult of a Banking_Cell step without applying it.
+
+        Args:
+            max_cost (float): Give up on legalizations costing more. By default beta times
+                EVALUATE_ROWS rows of displacement, which keeps a query to the bands close
+                to y; math.inf for no limit.
+
+        Returns:
+            StepResult: Or None when the step can't be legalized (within max_cost).
+        """
+        if max_cost is None:
+            max_cost = self.beta * EVALUATE_ROWS * self.free.row_height
+        try:
+            result = self.try_step(merge_name, removed, x, y, w, h, max_cost)
+        except LegalizeError:
+            return None
+        self.rollback()
+        return result
+
+    def legalize_step(self, merge_name, removed, x, y, w, h):
+        """
+        Apply one Banking_Cell step.
+
+        Returns:
+            tuple: (merge_x, merge_y, moved) in _post.lg order, moved is a list of (name, x, y).
+        """
+        result = self.try_step(merge_name, removed, x, y, w, h)
+        self.commit()
+        return result.x, result.y, result.moved
+
+    def run(self, opt_steps):
+        """Legalize every step of an OptSteps, yielding legalize_step results in order."""
+        columns = (opt_steps.x.tolist(), opt_steps.y.tolist(), opt_steps.w.tolist(), opt_steps.h.tolist())
+        for i, (name, x, y, w, h) in enumerate(zip(opt_steps.merge_names, *columns)):
+            yield self.legalize_step(name, opt_steps.removed(i), x, y, w, h)
+
+
+def write_post_step(f, merge_x, merge_y, moved):
+    """Write one step in _post.lg format."""
+    f.write(f"{merge_x} {merge_y}\n{len(moved)}\n")
+    for name, x, y in moved:
+        f.write(f"{name} {x} {y}\n")
@@ -0,0 +1,223 @@
+from bisect import bisect_left, bisect_right
+
+
+class FreeRows:
+    """
+    Per-row index of the free x-intervals of a placement.
+
+    Row r covers y in [y0 + r * row_height, y0 + (r + 1) * row_height). Its free
+    space is kept as two sorted lists starts[r] / ends[r] of disjoint half-open
+    intervals [starts[r][i], ends[r][i]) that never touch, so the free run
+    around any x is one bisect away. A cell blocks every row its y-range
+    touches, also the partially covered top row of a cell whose height is not a
+    multiple of the row height.
+    """
+    def __init__(self, y0, row_height, num_rows):
+        self.y0 = y0
+        self.row_height = row_height
+        self.num_rows = num_rows
+        self.starts = [[] for _ in range(num_rows)]
+        self.ends = [[] for _ in range(num_rows)]
+        # placement row segments of every row, release never frees space outside them
+        self.row_starts = [[] for _ in range(num_rows)]
+        self.row_ends = [[] for _ in range(num_rows)]
+        # stamp of the last change of every row, lets band caches (BandIndex) detect stale entries
+        self.versions = [0] * num_rows
+        self._stamp = 0
+        # changes undone by _restore, per row {version before: (i, j, new starts, new ends, version after)}
+        self._undone = [{} for _ in range(num_rows)]
+        # undo records of the pending tentative step (Legalizer.try_step), None outside of one
+        self.journal = None
+
+    @classmethod
+    def from_placement(cls, placement):
+        """
+        Build the index from a Placement: all placement rows free, then every cell occupied.
+
+        Args:
+            placement (Placement): Parsed .lg file.
+
+        Returns:
+            FreeRows: Free space of the legalized placement.
+        """
+        rows = placement.rows.tolist()
+        # rows share their height and sit on the grid of the first row, same as the checker
+        y0 = rows[0][1]
+        row_height = rows[0][3]
+        num_rows = (max(start_y for _, start_y, _, _, _ in rows) - y0) // row_height + 1
+        free_rows = cls(y0, row_height, num_rows)
+        for start_x, start_y, site_width, _, num_sites in sorted(rows):
+            r = (start_y - y0) // row_height
+            end_x = start_x + site_width * num_sites
+            splice = cls._union(free_rows.row_starts[r], free_rows.row_ends[r], start_x, end_x)
+            if splice is not None:
+                i, j, new_starts, new_ends = splice
+                free_rows.row_starts[r][i:j] = new_starts
+                free_rows.row_ends[r][i:j] = new_ends
+            free_rows._splice(r, cls._union(free_rows.starts[r], free_rows.ends[r], start_x, end_x))
+        columns = (placement.x.tolist(), placement.y.tolist(), placement.w.tolist(), placement.h.tolist())
+        for x, y, w, h in zip(*columns):
+            free_rows.occupy(x, y, w, h)
+        return free_rows
+
+    def row_y(self, r):
+        return self.y0 + r * self.row_height
+
+    def row_span(self, y, h):
+        """Rows [lo, hi) touched by a cell at y with height h, clipped to the index."""
+        lo = (y - self.y0) // self.row_height
+        hi = -((self.y0 - y - h) // self.row_height)
+        return max(lo, 0), min(max(hi, lo + 1), self.num_rows)
+
+    def rows_for_height(self, h):
+        return max(1, -(-h // self.row_height))
+
+    def occupy(self, x, y, w, h):
+        lo, hi = self.row_span(y, h)
+        for r in range(lo, hi):
+            self._splice(r, self._cut(self.starts[r], self.ends[r], x, x + w))
+
+    def release(self, x, y, w, h):
+        lo, hi = self.row_span(y, h)
+        for r in range(lo, hi):
+            row_starts, row_ends = self.row_starts[r], self.row_ends[r]
+            i = bisect_right(row_ends, x)
+            while i < len(row_starts) and row_starts[i] < x + w:
+                self._splice(r, self._union(self.starts[r], self.ends[r], max(x, row_starts[i]), min(x + w, row_ends[i])))
+                i += 1
+
+    def is_free(self, x, y, w, h):
+        lo, hi = self.row_span(y, h)
+        for r in range(lo, hi):
+            starts, ends = self.starts[r], self.ends[r]
+            i = bisect_right(starts, x) - 1
+            if i < 0 or ends[i] < x + w:
+                return False
+        return True
+
+    def free_run(self, r, x):
+        """
+        Free interval of row r containing x.
+
+        Returns:
+            tuple: (start, end) or None if x is occupied or outside the row.
+        """
+        starts, ends = self.starts[r], self.ends[r]
+        i = bisect_right(starts, x) - 1
+        if i >= 0 and ends[i] > x:
+            return starts[i], ends[i]
+        return None
+
+    def _splice(self, r, splice):
+        if splice is None:
+            return
+        i, j, new_starts, new_ends = splice
+        starts, ends = self.starts[r], self.ends[r]
+        if self.journal is not None:
+            self.journal.append((self._restore, r, i, len(new_starts), starts[i:j], ends[i:j], self.versions[r]))
+        # a stamp names one content of the row: restoring one on undo revives exactly the caches
+        # built before the change, and redoing an undone change (the same banking evaluated at
+        # another position) revives the ones built after it
+        undone = self._undone[r].get(self.versions[r])
+        if undone is not None and undone[:4] == (i, j, new_starts, new_ends):
+            self.versions[r] = undone[4]
+        else:
+            self._stamp += 1
+            self.versions[r] = self._stamp
+        starts[i:j] = new_starts
+        ends[i:j] = new_ends
+
+    def _restore(self, r, i, n, old_starts, old_ends, version):
+        undone = self._undone[r]
+        if len(undone) >= 4:
+            del undone[next(iter(undone))]
+        undone[version] = (i, i + len(old_starts), self.starts[r][i:i + n], self.ends[r][i:i + n], self.versions[r])
+        self.starts[r][i:i + n] = old_starts
+        self.ends[r][i:i + n] = old_ends
+        self.versions[r] = version
+
+    @staticmethod
+    def _cut(starts, ends, a, b):
+        """Splice (i, j, new starts, new ends) taking [a, b) out of an interval list, None if none of it is free."""
+        i = bisect_right(ends, a)
+        j = bisect_left(starts, b)
+        if i >= j:
+            return None
+        keep_starts, keep_ends = [], []
+        if starts[i] < a:
+            keep_starts.append(starts[i])
+            keep_ends.append(a)
+        if ends[j - 1] > b:
+            keep_starts.append(b)
+            keep_ends.append(ends[j - 1])
+        return i, j, keep_starts, keep_ends
+
+    @staticmethod
+    def _union(starts, ends, a, b):
+        """Splice (i, j, new starts, new ends) merging [a, b) into an interval list, None if it is empty."""
+        if a >= b:
+            return None
+        i = bisect_left(ends, a)
+        j = bisect_right(starts, b)
+        if i < j:
+            a = min(a, starts[i])
+            b = max(b, ends[j - 1])
+        return i, j, [a], [b]
+
+
+class RowCells:
+    """
+    Per-row index of the cells of a placement, sorted by x.
+
+    Row r lists the cells whose y-range touches it as parallel lists xs[r]
+    (lower-left x) and cells[r] (cell index), so the neighbours of any x are
+    one bisect away. Rows are on the grid of a FreeRows.
+    """
+    def __init__(self, free_rows):
+        self.free = free_rows
+        self.xs = [[] for _ in range(free_rows.num_rows)]
+        self.cells = [[] for _ in range(free_rows.num_rows)]
+        # undo records of the pending tentative step, shared with FreeRows.journal
+        self.journal = None
+
+    @classmethod
+    def from_placement(cls, placement, free_rows):
+        row_cells = cls(free_rows)
+        columns = (placement.x.tolist(), placement.y.tolist(), placement.h.tolist())
+        for i, (x, y, h) in enumerate(zip(*columns)):
+            lo, hi = free_rows.row_span(y, h)
+            for r in range(lo, hi):
+                row_cells.xs[r].append(x)
+                row_cells.cells[r].append(i)
+        for r in range(free_rows.num_rows):
+            order = sorted(range(len(row_cells.xs[r])), key=row_cells.xs[r].__getitem__)
+            row_cells.xs[r] = [row_cells.xs[r][k] for k in order]
+            row_cells.cells[r] = [row_cells.cells[r][k] for k in order]
+        return row_cells
+
+    def add(self, i, x, y, h):
+        lo, hi = self.free.row_span(y, h)
+        for r in range(lo, hi):
+            j = bisect_right(self.xs[r], x)
+            self._put(r, j, x, i)
+            if self.journal is not None:
+                self.journal.append((self._drop, r, j))
+
+    def discard(self, i, x, y, h):
+        lo, hi = self.free.row_span(y, h)
+        for r in range(lo, hi):
+            xs, cells = self.xs[r], self.cells[r]
+            j = bisect_left(xs, x)
+            while cells[j] != i:
+                j += 1
+            self._drop(r, j)
+            if self.journal is not None:
+                self.journal.append((self._put, r, j, x, i))
+
+    def _put(self, r, j, x, i):
+        self.xs[r].insert(j, x)
+        self.cells[r].insert(j, i)
+
+    def _drop(self, r, j):
+        del self.xs[r][j]
+        del self.cells[r][j]
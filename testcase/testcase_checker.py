@@ -1,5 +1,10 @@
 import argparse
-import math
+import bisect
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from LgParser import load_lg, load_opt, iter_post
 
 class Rect:
     def __init__(self, instName, startX, startY, w, h, isFix):
@@ -29,9 +34,8 @@ class PlacementRow:
         self.siteHeight = siteHeight
         self.totalNumOfSites = totalNumoOfSites
 
-
 class Checker:
-    def __init__(self, lg_file, opt_file):
+    def __init__(self, lg_file, opt_file, post_file=None):
         self.alpha = 0
         self.beta = 0
         self.dieOrigin = [0, 0]
@@ -40,6 +44,7 @@ class Checker:
         self.placementrows = []
         self.lg_file = lg_file
         self.opt_file = opt_file
+        self.post_file = post_file
         self.readLegalizePlacement()
 
     def run(self):
@@ -48,44 +53,27 @@ class Checker:
         self.checkDieBoundary()
         self.checkOverlap()
         self.checkOnSite()
+        if self.post_file:
+            self.replayPostPlacement()
         print("[CHECKER] All Check Pass")
 
     def initialChecker(self):
         self.sortRects(self.cells)
 
     def readLegalizePlacement(self):
-        with open(self.lg_file, 'r') as f:
-            lines = f.readlines()
-
-        for line in lines:
-            value = line.strip().split(' ')
-
-            # read parameter
-            if value[0] == "Alpha":
-                self.alpha = value[1]
-            
-            if value[0] == "Beta":
-                self.beta = value[1]
-
-            # read die info
-            if value[0] == "DieSize":
-                self.dieOrigin[0] = int(value[1])
-                self.dieOrigin[1] = int(value[2])
-                self.dieBorder[0] = int(value[3])
-                self.dieBorder[1] = int(value[4])
-
-            # read cell info
-            if value[0].startswith("FF_1") or value[0].startswith("C"):
-                instName, startX, startY, w, h, isFix = value
-                self.cells.append(Rect(instName, int(startX), int(startY), int(w), int(h), isFix))
-
-            # read placementrow info
-            if value[0] == "PlacementRows":
-                startX, startY, siteWidth, siteHeight, totalNumOfSites = int(value[1]), int(value[2]), int(value[3]), int(value[4]), int(value[5])
-                self.placementrows.append(PlacementRow(startX, startY, siteWidth, siteHeight, totalNumOfSites))
-
-
-        print("(alpha, beta) = " + self.alpha + " " + self.beta)
+        placement = load_lg(self.lg_file)
+        self.alpha = placement.alpha
+        self.beta = placement.beta
+        self.dieOrigin[0], self.dieOrigin[1], self.dieBorder[0], self.dieBorder[1] = placement.die
+
+        columns = (placement.x.tolist(), placement.y.tolist(), placement.w.tolist(), placement.h.tolist(), placement.fixed.tolist())
+        for instName, startX, startY, w, h, isFix in zip(placement.names, *columns):
+            self.cells.append(Rect(instName, startX, startY, w, h, "FIX" if isFix else "NOTFIX"))
+
+        for startX, startY, siteWidth, siteHeight, totalNumOfSites in placement.rows.tolist():
+            self.placementrows.append(PlacementRow(startX, startY, siteWidth, siteHeight, totalNumOfSites))
+
+        print(f"(alpha, beta) = {self.alpha:g} {self.beta:g}")
         print(self.dieOrigin[0], self.dieOrigin[1], self.dieBorder[0], self.dieBorder[1])
         print("Num of cells: ",  len(self.cells))
         print("Num of placementrows: ", len(self.placementrows))
@@ -97,25 +85,47 @@ class Checker:
     def checkDieBoundary(self):
         print("[CHECKER] Check Die Boundary")
         for cell in self.cells:
-            if cell.startX < self.dieOrigin[0] or cell.endX > self.dieBorder[0]:
-                print(f"[CHECKER] {cell.instName}: {cell.startX} {cell.endX}")
-                raise AssertionError("Over x-axis Die Boundary !!")
-            elif cell.startY < self.dieOrigin[1] or cell.endY > self.dieBorder[1]:
-                print(f"[CHECKER] {cell.instName}: {cell.startY} {cell.endY}")
-                raise AssertionError("Over y-axis Die Boundary !!")
+            self.checkRectBoundary(cell)
+
+    def checkRectBoundary(self, rect):
+        if rect.startX < self.dieOrigin[0] or rect.endX > self.dieBorder[0]:
+            print(f"[CHECKER] {rect.instName}: {rect.startX} {rect.endX}")
+            raise AssertionError("Over x-axis Die Boundary !!")
+        elif rect.startY < self.dieOrigin[1] or rect.endY > self.dieBorder[1]:
+            print(f"[CHECKER] {rect.instName}: {rect.startY} {rect.endY}")
+            raise AssertionError("Over y-axis Die Boundary !!")
 
     def checkOverlap(self):
         print("[CHECKER] Check Overlap")
-        for i in range(len(self.cells) - 1):
-            cell1 = self.cells[i]
-            for j in range(i + 1, len(self.cells)):
-                cell2 = self.cells[j]
-                if cell2.startX > cell1.endX:
-                    break
-                if self.overlap(cell1, cell2):
-                    print(f"[CHECKER] {cell1.instName} {cell2.instName}")
-                    raise AssertionError(f"Overlap between {cell1.instName} and {cell2.instName} !!")
-                    
+        # bucket cells by the placement rows they span, cells are already sorted
+        # by startX so every row bucket stays sorted by x
+        rowBuckets = {}
+        for cell in self.cells:
+            for rowIdx in self.spannedRows(cell):
+                rowBuckets.setdefault(rowIdx, []).append(cell)
+
+        # sweep each row, only the cell reaching furthest right can overlap the next one
+        for rowCells in rowBuckets.values():
+            reachCell = rowCells[0]
+            for cell in rowCells[1:]:
+                if cell.startX < reachCell.endX and self.overlap(reachCell, cell):
+                    print(f"[CHECKER] {reachCell.instName} {cell.instName}")
+                    raise AssertionError(f"Overlap between {reachCell.instName} and {cell.instName} !!")
+                if cell.endX > reachCell.endX:
+                    reachCell = cell
+
+    def spannedRows(self, rect):
+        # row index is taken on the grid of the first placement row, same as the evaluator
+        if self.placementrows:
+            rowInitialY = self.placementrows[0].startY
+            rowHeight = self.placementrows[0].siteHeight
+        else:
+            rowInitialY = self.dieOrigin[1]
+            rowHeight = max(1, self.dieBorder[1] - self.dieOrigin[1])
+        rowIdxLow = (rect.startY - rowInitialY) // rowHeight
+        rowIdxHigh = -((rowInitialY - rect.endY) // rowHeight)
+        return range(rowIdxLow, max(rowIdxHigh, rowIdxLow + 1))
+
     @staticmethod
     def overlap(rect1, rect2):
         rectUp = rect1 if rect1.startY > rect2.startY else rect2
@@ -126,31 +136,138 @@ class Checker:
         rectRight = rect2 if rect1.startX < rect2.startX else rect1
         return rectRight.startX < rectLeft.endX
 
+    def buildRowIndex(self):
+        # startY -> x-segments of the rows sharing that y, sorted by startX
+        rowIndex = {}
+        for row in self.placementrows:
+            rowEndX = row.startX + row.siteWidth * row.totalNumOfSites
+            rowIndex.setdefault(row.startY, []).append((row.startX, rowEndX, row.siteWidth))
+        for startY, segments in rowIndex.items():
+            segments.sort()
+            rowIndex[startY] = ([segment[0] for segment in segments], segments)
+        return rowIndex
+
     def checkOnSite(self):
         print("[CHECKER] Check On Site")
+        rowIndex = self.buildRowIndex()
         for cell in self.cells:
-            isOnSite = False
-            for row in self.placementrows:
-                rowStartX = row.startX
-                rowEndX = rowStartX + row.siteWidth * row.totalNumOfSites
-                if cell.startY == row.startY:
-                    if rowStartX <= cell.startX < rowEndX:
-                        if math.floor((cell.startX - rowStartX) / row.siteWidth) == (cell.startX - rowStartX) / row.siteWidth:
-                            isOnSite = True
-                            break
-                elif cell.startY < row.startY:
-                    break
-            if not isOnSite:
+            if not self.isOnSite(rowIndex, cell):
                 print(f"[CHECKER] {cell.instName}")
                 raise AssertionError(f"{cell.instName} Not On Site !!")
 
+    @staticmethod
+    def isOnSite(rowIndex, rect):
+        if rect.startY not in rowIndex:
+            return False
+        segmentStarts, segments = rowIndex[rect.startY]
+        i = bisect.bisect_right(segmentStarts, rect.startX) - 1
+        if i < 0:
+            return False
+        rowStartX, rowEndX, siteWidth = segments[i]
+        return rect.startX < rowEndX and (rect.startX - rowStartX) % siteWidth == 0
+
+    def replayPostPlacement(self):
+        print("[CHECKER] Replay Post Placement")
+        steps = load_opt(self.opt_file)
+        rowIndex = self.buildRowIndex()
+        cellMap = {cell.instName: cell for cell in self.cells}
+        originCoor = {}
+        # last position of moved cells that were banked later, still counted in the displacement
+        bankedCoor = {}
+        moveTimes = 0
+
+        # incremental spatial index: row -> cells in that row sorted by (startX, instName)
+        rowCells = {}
+        for cell in self.cells:
+            for rowIdx in self.spannedRows(cell):
+                rowCells.setdefault(rowIdx, []).append((cell.startX, cell.instName))
+        for keys in rowCells.values():
+            keys.sort()
+
+        numPostSteps = 0
+        for i, (mergeX, mergeY, movedCells) in enumerate(iter_post(self.post_file)):
+            if i >= len(steps):
+                raise AssertionError(f"Number of steps in post file more than opt file ({len(steps)}) !!")
+            numPostSteps += 1
+            mergeName = steps.merge_names[i]
+            for instName in steps.removed(i):
+                if instName not in cellMap:
+                    raise AssertionError(f"Banking_Cell {mergeName}: {instName} not exist !!")
+                cell = cellMap.pop(instName)
+                if instName in originCoor:
+                    bankedCoor[instName] = (cell.startX, cell.startY)
+                self.eraseRowCell(rowCells, cell)
+
+            mergeCell = Rect(mergeName, mergeX, mergeY, int(steps.w[i]), int(steps.h[i]), "NOTFIX")
+            originCoor[mergeName] = (int(steps.x[i]), int(steps.y[i]))
+            cellMap[mergeName] = mergeCell
+
+            touchedCells = [mergeCell]
+            for instName, x, y in movedCells:
+                cell = cellMap.get(instName)
+                if cell is None:
+                    raise AssertionError(f"Banking_Cell {mergeName}: moved cell {instName} not exist !!")
+                if cell.isFix == "FIX":
+                    raise AssertionError(f"Banking_Cell {mergeName}: {instName} is fixed, can't move !!")
+                self.eraseRowCell(rowCells, cell)
+                originCoor.setdefault(instName, (cell.startX, cell.startY))
+                cell.startX, cell.startY = x, y
+                touchedCells.append(cell)
+                moveTimes += 1
+
+            for cell in touchedCells:
+                for rowIdx in self.spannedRows(cell):
+                    bisect.insort(rowCells.setdefault(rowIdx, []), (cell.startX, cell.instName))
+
+            # legality only has to be rechecked around the cells this step touched
+            for cell in touchedCells:
+                self.checkRectBoundary(cell)
+                if not self.isOnSite(rowIndex, cell):
+                    print(f"[CHECKER] Banking_Cell {mergeName}: {cell.instName}")
+                    raise AssertionError(f"{cell.instName} Not On Site !!")
+                self.checkRowNeighbors(rowCells, cellMap, cell)
+
+        if numPostSteps != len(steps):
+            raise AssertionError(f"Number of steps in post file ({numPostSteps}) not equal to opt file ({len(steps)}) !!")
+
+        totalDisplacement = 0
+        for instName, (originX, originY) in originCoor.items():
+            cell = cellMap.get(instName)
+            x, y = (cell.startX, cell.startY) if cell is not None else bankedCoor[instName]
+            totalDisplacement += abs(x - originX) + abs(y - originY)
+        timesCost = self.alpha * moveTimes
+        disCost = self.beta * totalDisplacement
+        print(f"[CHECKER] Steps: {len(steps)}")
+        print(f"[CHECKER] Move Times: {moveTimes} * {self.alpha:g} = {timesCost:.3f}")
+        print(f"[CHECKER] Total Distance: {totalDisplacement} * {self.beta:g} = {disCost:.3f}")
+        print(f"[CHECKER] Total Cost: {timesCost + disCost:.3f}")
+
+    def eraseRowCell(self, rowCells, rect):
+        key = (rect.startX, rect.instName)
+        for rowIdx in self.spannedRows(rect):
+            keys = rowCells[rowIdx]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def checkRowNeighbors(self, rowCells, cellMap, rect):
+        # rows were legal before the step, so only the direct neighbours in x can overlap
+        for rowIdx in self.spannedRows(rect):
+            keys = rowCells[rowIdx]
+            i = bisect.bisect_left(keys, (rect.startX, rect.instName))
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(keys):
+                    neighbor = cellMap[keys[j][1]]
+                    if self.overlap(rect, neighbor):
+                        print(f"[CHECKER] {rect.instName} {neighbor.instName}")
+                        raise AssertionError(f"Overlap between {rect.instName} and {neighbor.instName} !!")
+
 def main():
     parser = argparse.ArgumentParser(description="Checker for FFs and Gates")
     parser.add_argument('--lg', type=str, required=True, help="Filename for legalized placement information")
     parser.add_argument('--opt', type=str, required=True, help="Filename for optimized step information")
+    parser.add_argument('--post', type=str, help="Filename for legalized result of every optimized step, replayed when given")
     args = parser.parse_args()
 
-    checker = Checker(args.lg, args.opt)
+    checker = Checker(args.lg, args.opt, args.post)
     checker.run()
 
 
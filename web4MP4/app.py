@@ -1,5 +1,13 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify
+from flask import Flask, render_template, send_from_directory, request, jsonify, make_response
+from collections import OrderedDict
+import hashlib
 import os
+import sys
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from LgParser import load_opt, index_post, read_post_at
 
 app = Flask(__name__)
 
@@ -12,56 +20,138 @@ DATA_FOLDER = os.path.join(app.root_path, 'static', 'data')
 if not os.path.exists(DATA_FOLDER):
     os.makedirs(DATA_FOLDER)
 
-def parse_opt(opt_file):
-    with open(opt_file, "r") as f:
-        lines = f.readlines()
-    steps = []
-    for line in lines:
-        if line.startswith("Banking_Cell"):
-            parts = line.split(":")[1].strip().split("-->")
-            inputs = parts[0].split()
-            output, *coords = parts[1].split()
-            steps.append({
-                "inputs": inputs,
-                "output": output,
-                "x": int(coords[0]),
-                "y": int(coords[1]),
-                "w": int(coords[2]),
-                "h": int(coords[3])
+# 已解析設計的 LRU 快取 (整個行程共用)，以檔案 mtime/大小判斷是否需要重新解析
+DESIGN_CACHE_SIZE = 8
+design_cache = OrderedDict()
+design_cache_lock = threading.Lock()
+
+# /get_steps 單次請求最多回傳的步數
+MAX_BATCH_STEPS = 2000
+STEP_FORMATS = ('json', 'columnar', 'binary')
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def files_digest(*paths):
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+class Design:
+    """一組 .opt 與 _post.lg：opt 步驟以欄位陣列保存，_post.lg 只保存每一步的 byte offset"""
+
+    def __init__(self, opt_path, postlg_path, signature):
+        self.signature = signature
+        self.steps = load_opt(opt_path)
+        self.postlg_path = postlg_path
+        self.post_offsets = index_post(postlg_path)
+        # 兩個檔案內容的雜湊，作為 /get_steps 的 ETag
+        self.etag = files_digest(opt_path, postlg_path)
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def num_steps(self):
+        """opt 與 _post.lg 都有資料的步數"""
+        return min(len(self.steps), len(self.post_offsets))
+
+    def read_moved(self, step_indices):
+        with open(self.postlg_path, 'rb') as f:
+            return [read_post_at(f, int(self.post_offsets[i]))[2] for i in step_indices]
+
+    def step_detail(self, step_index):
+        return self.step_details([step_index])[0]
+
+    def step_details(self, step_indices):
+        """多個步驟的 /get_step_detail 格式，_post.lg 只開啟一次"""
+        steps = self.steps
+        details = []
+        for step_index, moved in zip(step_indices, self.read_moved(step_indices)):
+            move_cell_list = [{"name": name, "x": x, "y": y} for name, x, y in moved]
+            details.append({
+                'merge_cell': steps.merge_names[step_index],
+                'merge_cell_position': {
+                    'x': int(steps.x[step_index]),
+                    'y': int(steps.y[step_index])
+                },
+                'delete_cell': steps.removed(step_index),
+                'number_of_move_cell': len(move_cell_list),
+                'move_cell': move_cell_list
             })
-    return steps
-
-def parse_postlg(postlg_file):
-    with open(postlg_file, "r") as f:
-        lines = f.readlines()
-    positions = []
-    moved_cells_list = []
-    i = 0
-    while i < len(lines):
-        # 解析合併單元格的位置
-        merged_ff = list(map(int, lines[i].split()))
-        positions.append({"x": merged_ff[0], "y": merged_ff[1]})
-        i += 1
-        if i >= len(lines):
-            moved_cells_list.append([])
-            break
-        # 解析移動單元格的數量
-        num_of_cells = int(lines[i].strip())
-        i += 1
-        current_moved_cells = []
-        if num_of_cells > 0:
-            for _ in range(num_of_cells):
-                if i >= len(lines):
-                    break
-                cell_info = lines[i].split()
-                current_moved_cells.append({
-                    "name": cell_info[0],
-                    "x": int(cell_info[1]),
-                    "y": int(cell_info[2])
-                })
-                i += 1
-        moved_cells_list.append(current_moved_cells)
-    return positions, moved_cells_list
+        return details
+
+    def step_columns(self, step_indices):
+        """多個步驟的欄位格式：刪除與移動的 cells 攤平成一維，以 offsets 切出每一步"""
+        steps = self.steps
+        index = np.asarray(step_indices, dtype=np.int64)
+        moved = self.read_moved(step_indices)
+        removed = [steps.removed(i) for i in step_indices]
+        return {
+            'step': (index + 1).tolist(),
+            'merge_cell': [steps.merge_names[i] for i in step_indices],
+            'x': steps.x[index].tolist(),
+            'y': steps.y[index].tolist(),
+            'delete_cell_offsets': [0] + np.cumsum([len(names) for names in removed], dtype=np.int64).tolist(),
+            'delete_cell': [name for names in removed for name in names],
+            'move_cell_offsets': [0] + np.cumsum([len(cells) for cells in moved], dtype=np.int64).tolist(),
+            'move_cell_name': [name for cells in moved for name, _, _ in cells],
+            'move_cell_x': [x for cells in moved for _, x, _ in cells],
+            'move_cell_y': [y for cells in moved for _, _, y in cells]
+        }
+
+def encode_step_columns(columns):
+    """
+    將 step_columns 編碼成二進位：
+    int64 little-endian 的 [步數 n, 刪除 cells 數 d, 移動 cells 數 m]、
+    step[n], x[n], y[n], delete_cell_offsets[n+1], move_cell_offsets[n+1], move_cell_x[m], move_cell_y[m]，
+    接著是以換行分隔的 UTF-8 名稱：merge_cell[n], delete_cell[d], move_cell_name[m]
+    """
+    counts = [len(columns['step']), len(columns['delete_cell']), len(columns['move_cell_name'])]
+    arrays = [counts] + [columns[key] for key in ('step', 'x', 'y', 'delete_cell_offsets', 'move_cell_offsets',
+                                                  'move_cell_x', 'move_cell_y')]
+    names = columns['merge_cell'] + columns['delete_cell'] + columns['move_cell_name']
+    return b''.join(np.asarray(values, dtype='<i8').tobytes() for values in arrays) + '\n'.join(names).encode()
+
+def parse_step_query(args, num_steps):
+    """解析 start/end 或 steps 參數，回傳 0-based 的步驟 index；格式錯誤時丟出 ValueError"""
+    if 'steps' in args:
+        requested = [int(value) for value in args['steps'].split(',') if value.strip()]
+    elif 'start' in args:
+        start = int(args['start'])
+        end = int(args.get('end', start))
+        if end < start:
+            raise ValueError("'end' must not be smaller than 'start'.")
+        # end 超過最後一步時截斷，方便前端以播放位置為中心預取
+        requested = list(range(start, min(end, max(start, num_steps)) + 1))
+    else:
+        raise ValueError("Missing 'start' or 'steps'.")
+    if not requested:
+        raise ValueError('No steps requested.')
+    if len(requested) > MAX_BATCH_STEPS:
+        raise ValueError(f'At most {MAX_BATCH_STEPS} steps per request.')
+    return [step - 1 for step in requested]
+
+def get_design(opt_path, postlg_path):
+    key = (opt_path, postlg_path)
+    signature = (file_signature(opt_path), file_signature(postlg_path))
+    with design_cache_lock:
+        design = design_cache.get(key)
+        if design is not None and design.signature == signature:
+            design_cache.move_to_end(key)
+            return design
+    # 解析在鎖外進行，避免大檔案擋住其他設計的請求
+    design = Design(opt_path, postlg_path, signature)
+    with design_cache_lock:
+        design_cache[key] = design
+        design_cache.move_to_end(key)
+        while len(design_cache) > DESIGN_CACHE_SIZE:
+            design_cache.popitem(last=False)
+    return design
 
 @app.route('/')
 def index():
@@ -106,11 +196,10 @@ def get_step_detail():
         return jsonify({'status': 'error', 'message': 'Data not Provide!'}), 404
 
     try:
-        steps = parse_opt(opt_path)
-        positions, moved_cells_list = parse_postlg(postlg_path)
+        design = get_design(opt_path, postlg_path)
 
-        num_steps_opt = len(steps)
-        num_steps_lg = len(positions)
+        num_steps_opt = len(design)
+        num_steps_lg = len(design.post_offsets)
 
         # 確保請求的步驟在範圍內
         if step < 1 or step > num_steps_opt:
@@ -121,22 +210,8 @@ def get_step_detail():
             print("Requested step is out of range in .lg file.")  # 調試用
             return jsonify({'status': 'error', 'message': 'Step out of range for position data.'}), 404
 
-        step_index = step - 1
-        step_data = steps[step_index]
-        position = positions[step_index] if step_index < len(positions) else {'x': 0, 'y': 0}
-        move_cell_list = moved_cells_list[step_index] if step_index < len(moved_cells_list) else []
-
-        response = {
-            'status': 'success',
-            'merge_cell': step_data['output'],
-            'merge_cell_position': {
-                'x': step_data['x'],
-                'y': step_data['y']
-            },
-            'delete_cell': step_data['inputs'],
-            'number_of_move_cell': len(move_cell_list),
-            'move_cell': move_cell_list
-        }
+        response = {'status': 'success'}
+        response.update(design.step_detail(step - 1))
 
         print(f"Response Data: {response}")  # 調試用
         return jsonify(response)
@@ -145,6 +220,61 @@ def get_step_detail():
         print(f"Error parsing files: {e}")  # 調試用
         return jsonify({'status': 'error', 'message': 'Error parsing data.'}), 500
 
+@app.route('/get_steps', methods=['GET'])
+def get_steps():
+    """一次取得一段範圍 (start, end) 或一串步驟 (steps=1,5,9) 的詳細資料，支援 ETag 快取"""
+    video = request.args.get('video')
+    output_format = request.args.get('format', 'json')
+
+    if not video or output_format not in STEP_FORMATS:
+        return jsonify({'status': 'error', 'message': 'Invalid parameters.'}), 400
+
+    opt_path = os.path.join(DATA_FOLDER, f"{video}.opt")
+    postlg_path = os.path.join(DATA_FOLDER, f"{video}_post.lg")
+
+    if not os.path.exists(opt_path) or not os.path.exists(postlg_path):
+        return jsonify({'status': 'error', 'message': 'Data not Provide!'}), 404
+
+    try:
+        design = get_design(opt_path, postlg_path)
+    except Exception as e:
+        print(f"Error parsing files: {e}")  # 調試用
+        return jsonify({'status': 'error', 'message': 'Error parsing data.'}), 500
+
+    try:
+        step_indices = parse_step_query(request.args, design.num_steps)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if any(i < 0 or i >= design.num_steps for i in step_indices):
+        return jsonify({'status': 'error', 'message': 'Step out of range.'}), 404
+
+    # 內容只取決於檔案與查詢參數 (URL)，因此 ETag 直接使用檔案雜湊
+    if design.etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        try:
+            if output_format == 'json':
+                steps = design.step_details(step_indices)
+                for i, detail in zip(step_indices, steps):
+                    detail['step'] = i + 1
+                response = jsonify({'status': 'success', 'steps': steps})
+            elif output_format == 'columnar':
+                columns = design.step_columns(step_indices)
+                columns['status'] = 'success'
+                response = jsonify(columns)
+            else:
+                response = make_response(encode_step_columns(design.step_columns(step_indices)))
+                response.mimetype = 'application/octet-stream'
+        except Exception as e:
+            print(f"Error reading steps: {e}")  # 調試用
+            return jsonify({'status': 'error', 'message': 'Error parsing data.'}), 500
+
+    response.set_etag(design.etag)
+    # 檔案可能被重新產生，每次使用前都要以 ETag 向伺服器確認
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/debug_routes')
 def debug_routes():
     """新增一個路由來列出所有已註冊的路由，以確認 /get_step_detail 是否存在"""